@@ -0,0 +1,178 @@
+import numpy, bitboard
+
+"""
+Batched bitboards
+
+Holds N boards in a numpy.uint64 array and plays them all at once, using the
+same row tables as bitboard through vectorized gathers. Directions are given
+as indexes into bitboard.directions.
+"""
+
+move_left_table = move_right_table = None
+col_up_table = col_down_table = None
+score_table = heuristic_table = col_heuristic_table = None
+
+# nibble offsets of the 16 tiles, lowest first, matching bitboard positions
+tile_shifts = numpy.arange(0, 64, 4, dtype = numpy.uint64)
+
+def init(weights = bitboard.heuristic_weights):
+  global move_left_table, move_right_table, col_up_table, col_down_table, \
+         score_table, heuristic_table, col_heuristic_table
+  bitboard.init(weights)
+  # widen the row tables up front so results can be shifted into place
+  # without overflowing
+  move_left_table = numpy.frombuffer(bitboard.move_left_table,
+                                     dtype = numpy.uint16).astype(numpy.uint64)
+  move_right_table = numpy.frombuffer(bitboard.move_right_table,
+                                      dtype = numpy.uint16).astype(numpy.uint64)
+  col_up_table = numpy.frombuffer(bitboard.col_up_table, dtype = numpy.uint64)
+  col_down_table = numpy.frombuffer(bitboard.col_down_table,
+                                    dtype = numpy.uint64)
+  score_table = numpy.frombuffer(bitboard.score_table,
+                                 dtype = numpy.uint32).astype(numpy.int64)
+  heuristic_table = numpy.frombuffer(bitboard.heuristic_table,
+                                     dtype = numpy.float64)
+  col_heuristic_table = numpy.frombuffer(bitboard.col_heuristic_table,
+                                         dtype = numpy.float64)
+
+def new_boards(n):
+  return numpy.zeros(n, dtype = numpy.uint64)
+
+# numpy won't mix uint64 with python ints in shifts, so every constant used
+# on a board goes through u
+def u(n):
+  return numpy.uint64(n)
+
+"""
+Returns the 4 rows of each board, lowest first
+"""
+def rows(boards):
+  mask = u(0xFFFF)
+  return (boards & mask, (boards >> u(16)) & mask, (boards >> u(32)) & mask,
+          boards >> u(48))
+
+"""
+Vectorized bitboard.transpose
+"""
+def transpose_batch(boards):
+  a1 = boards & u(0xF0F00F0FF0F00F0F)
+  a2 = boards & u(0x0000F0F00000F0F0)
+  a3 = boards & u(0x0F0F00000F0F0000)
+  a = a1 | (a2 << u(12)) | (a3 >> u(12))
+  b1 = a & u(0xFF00FF0000FF00FF)
+  b2 = a & u(0x00FF00FF00000000)
+  b3 = a & u(0x00000000FF00FF00)
+  return b1 | (b2 >> u(24)) | (b3 << u(24))
+
+def move_rows(boards, table):
+  r0, r1, r2, r3 = rows(boards)
+  return (table[r0] | (table[r1] << u(16)) | (table[r2] << u(32)) |
+          (table[r3] << u(48)),
+          score_table[r0] + score_table[r1] + score_table[r2] +
+          score_table[r3])
+
+def move_cols(boards, table):
+  c0, c1, c2, c3 = rows(transpose_batch(boards))
+  return (table[c0] | (table[c1] << u(4)) | (table[c2] << u(8)) |
+          (table[c3] << u(12)),
+          score_table[c0] + score_table[c1] + score_table[c2] +
+          score_table[c3])
+
+"""
+Returns every board moved in its direction along with the increase in score.
+dirs is either a single direction index for all the boards or an array of
+one per board
+"""
+def move_batch(boards, dirs):
+  if numpy.ndim(dirs) == 0:
+    return move_one(boards, int(dirs))
+  res = numpy.empty_like(boards)
+  scores = numpy.empty(len(boards), dtype = numpy.int64)
+  for dir in range(4):
+    idx = numpy.flatnonzero(dirs == dir)
+    if len(idx):
+      res[idx], scores[idx] = move_one(boards[idx], dir)
+  return res, scores
+
+def move_one(boards, dir):
+  if dir == 0:
+    return move_rows(boards, move_left_table)
+  elif dir == 1:
+    return move_rows(boards, move_right_table)
+  elif dir == 2:
+    return move_cols(boards, col_up_table)
+  elif dir == 3:
+    return move_cols(boards, col_down_table)
+  raise bitboard.InvalidMoveDirection(dir)
+
+"""
+Returns an N x 16 array that is True where a tile is empty, lowest position
+first as in bitboard.empty_tiles
+"""
+def empty_batch(boards):
+  return ((boards[:, None] >> tile_shifts) & u(0xF)) == 0
+
+def count_empty_batch(boards):
+  return empty_batch(boards).sum(axis = 1)
+
+"""
+Returns the boards with a tile spawned on a random empty position of each,
+a 2 90% of the time and a 4 otherwise. Full boards are returned unchanged
+"""
+def spawn_batch(boards, rng):
+  empty = empty_batch(boards)
+  counts = empty.sum(axis = 1)
+  # pick the k-th empty tile of each board
+  k = (rng.random(len(boards)) * counts).astype(numpy.int64)
+  pos = (numpy.cumsum(empty, axis = 1) > k[:, None]).argmax(axis = 1)
+  # log values, so 2 is 4 and 1 is 2
+  tiles = numpy.where(rng.random(len(boards)) < 0.1, 2, 1).astype(numpy.uint64)
+  spawned = boards | (tiles << (u(4) * pos.astype(numpy.uint64)))
+  return numpy.where(counts > 0, spawned, boards)
+
+"""
+Returns True for every board with no moves left
+"""
+def game_over_batch(boards):
+  over = count_empty_batch(boards) == 0
+  for dir in range(4):
+    idx = numpy.flatnonzero(over)
+    if not len(idx):
+      break
+    over[idx] = move_one(boards[idx], dir)[0] == boards[idx]
+  return over
+
+"""
+Vectorized bitboard.heuristic_value
+"""
+def heuristic_batch(boards):
+  r0, r1, r2, r3 = rows(boards)
+  c0, c1, c2, c3 = rows(transpose_batch(boards))
+  table, col_table = heuristic_table, col_heuristic_table
+  return table[r0] + table[r1] + table[r2] + table[r3] + \
+         col_table[c0] + col_table[c1] + col_table[c2] + col_table[c3]
+
+def max_tile_batch(boards):
+  ranks = ((boards[:, None] >> tile_shifts) & u(0xF)).max(axis = 1)
+  return numpy.where(ranks == 0, 0, numpy.left_shift(1, ranks.astype(numpy.int64)))
+
+"""
+Plays n games making random moves until every one is over. As in
+client.run_iteration, moves that don't change a board don't count and don't
+spawn a tile. Returns the final boards, move counts and scores
+"""
+def random_games(n, rng):
+  boards = spawn_batch(spawn_batch(new_boards(n), rng), rng)
+  moves = numpy.zeros(n, dtype = numpy.int64)
+  scores = numpy.zeros(n, dtype = numpy.int64)
+  live = numpy.flatnonzero(~game_over_batch(boards))
+  while len(live):
+    current = boards[live]
+    res, score_inc = move_batch(current, rng.integers(0, 4, len(live)))
+    changed = res != current
+    res[changed] = spawn_batch(res[changed], rng)
+    boards[live] = res
+    moves[live] += changed
+    scores[live] += score_inc
+    live = live[~game_over_batch(res)]
+  return boards, moves, scores
@@ -0,0 +1,237 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import time, random, statistics, json, sys, argparse, contextlib, io, \
+       bitboard, expectimax, engines
+
+"""
+Microbenchmarks for the board primitives
+
+Each primitive is run over a fixed corpus of positions from real games and
+timed in ns per call. The corpus is played with bitboard expectimax from a
+seed and split into mid-game positions (the middle third of each game) and
+late-game positions (the last third), and list boards get the same positions
+converted with bitboard.to_list.
+
+A run can be saved as a baseline, corpus included, and later runs compared
+against it: a primitive regresses when its median ns/op grows by more than
+the threshold, and the comparison fails if any does.
+"""
+
+stages = ("mid", "late")
+
+"""
+Plays games from seed with depth 1 expectimax and returns {stage: boards},
+taking count positions of each stage spread evenly over the games
+"""
+def corpus(count, seed = 0, games = 4):
+  bitboard.init()
+  random.seed(seed)
+  picked = {stage: [] for stage in stages}
+  for _ in range(games):
+    positions = []
+    state = bitboard.spawn_tile(bitboard.spawn_tile(bitboard.new_board()))
+    while not bitboard.game_over(state):
+      positions.append(state)
+      _, move = expectimax.expectimax(state, 1, bitboard)
+      state = bitboard.spawn_tile(bitboard.move(state, move)[0])
+    third = len(positions) // 3
+    per_game = -(-count // games)
+    for stage, section in (("mid", positions[third:2 * third]),
+                           ("late", positions[2 * third:])):
+      step = max(1, len(section) // per_game)
+      picked[stage] += section[::step][:per_game]
+  return {stage: boards[:count] for stage, boards in picked.items()}
+
+"""
+Returns {name: (function, boards)} for the primitives of imp, where function
+is called on each of the boards in turn. Primitives that don't take a board
+are given a list of Nones instead, one per call
+"""
+def primitives(imp, boards):
+  # spawning needs an empty tile
+  open_boards = [b for b in boards if imp.empty_tiles(b)]
+  # time the table lookups rather than the cache in front of them
+  heuristic = getattr(imp.heuristic_value, "__wrapped__", imp.heuristic_value)
+  res = {}
+  for dir in imp.directions:
+    res["move_" + dir] = (lambda b, dir = dir: imp.move(b, dir), boards)
+  res["spawn_tile"] = (imp.spawn_tile, open_boards)
+  res["empty_tiles"] = (imp.empty_tiles, boards)
+  res["game_over"] = (imp.game_over, boards)
+  res["heuristic_value"] = (heuristic, boards)
+  res["max_tile"] = (imp.max_tile, boards)
+  res["init"] = (lambda _: imp.init(), [None] * 20)
+  if imp == bitboard:
+    # the move tables take a second or so to build, so once per pass
+    res["build_moves"] = (lambda _: bitboard.build_moves(), [None])
+    res["build_heuristics"] = (lambda _: bitboard.build_heuristics(),
+                               [None] * 5)
+  return res
+
+"""
+Times f over boards repeats times and returns the ns per call of each repeat
+"""
+def measure(f, boards, repeats):
+  samples = []
+  for _ in range(repeats):
+    start = time.perf_counter_ns()
+    for b in boards:
+      f(b)
+    samples.append((time.perf_counter_ns() - start) / len(boards))
+  return samples
+
+def summarize(samples):
+  return {
+    "median": statistics.median(samples),
+    "mean": statistics.mean(samples),
+    "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    "min": min(samples),
+    "samples": samples,
+  }
+
+"""
+Runs every primitive matching only (all of them if None) on each stage of
+boards, and returns {"imp/stage/primitive": summary}
+"""
+def run(boards, imps = ("board", "bitboard"), repeats = 5, only = None):
+  results = {}
+  for imp_name in imps:
+    imp = engines.get(imp_name)
+    imp.init()
+    for stage in stages:
+      stage_boards = boards[stage] if imp == bitboard else \
+                     [imp.from_list(bitboard.to_list(b)) for b in boards[stage]]
+      for name, (f, inputs) in primitives(imp, stage_boards).items():
+        if only is not None and name not in only:
+          continue
+        # init and table builds don't depend on the boards
+        boardless = inputs[0] is None
+        if boardless and stage != stages[0]:
+          continue
+        key = f"{imp_name}/{name}" if boardless else \
+              f"{imp_name}/{stage}/{name}"
+        # the move tables take a second or so, so fewer repeats will do
+        n = repeats if name != "build_moves" else min(repeats, 3)
+        # building tables reports itself, which would break up the results
+        with contextlib.redirect_stdout(io.StringIO()):
+          samples = measure(f, inputs, n)
+        results[key] = summarize(samples)
+        report(key, results[key])
+    # leave the tables the way the rest of the run expects them
+    imp.init()
+  return results
+
+def report(key, summary, baseline = None):
+  line = f"{key:<36} {summary['median']:>14,.0f} ns/op " \
+         f"± {summary['stdev']:>12,.0f}"
+  if baseline is not None:
+    line += f"  ({change(summary, baseline):+.1%} vs baseline)"
+  print(line)
+
+def change(summary, baseline):
+  return summary["median"] / baseline["median"] - 1
+
+"""
+Returns the keys of results whose median is more than threshold slower than
+in baseline
+"""
+def regressions(results, baseline, threshold):
+  return [key for key in results if key in baseline and
+          change(results[key], baseline[key]) > threshold]
+
+"""
+Checks that the NumPy heuristic table build matches the scalar one bit for bit
+for the default weights and count random variations of them, printing each
+mismatch. Returns whether they all matched
+"""
+def parity(count, seed = 0):
+  rng = random.Random(seed)
+  cases = [bitboard.heuristic_weights]
+  for _ in range(count):
+    # scale every weight by up to 4 times either way
+    cases.append(tuple(w * 2 ** rng.uniform(-2, 2)
+                       for w in bitboard.heuristic_weights))
+  ok = True
+  for weights in cases:
+    with contextlib.redirect_stdout(io.StringIO()):
+      rows = bitboard.heuristics_parity(weights)
+    if rows:
+      print(f"{rows} rows differ for weights {weights}")
+      ok = False
+  print(f"Heuristic table parity checked for {len(cases)} weights: "
+        f"{'ok' if ok else 'FAILED'}")
+  return ok
+
+def save(path, boards, results, seed):
+  with open(path, "w") as f:
+    json.dump({"seed": seed,
+               "corpus": {stage: [hex(b) for b in boards[stage]]
+                          for stage in stages},
+               "results": results}, f, indent = 1)
+
+def load(path):
+  with open(path) as f:
+    data = json.load(f)
+  boards = {stage: [int(b, 16) for b in data["corpus"][stage]]
+            for stage in stages}
+  return boards, data["results"]
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Time the board primitives over positions from real games")
+  parser.add_argument("--imp", choices = list(engines.registry),
+                      action = "append", default = None,
+                      help = "implementation to time, repeatable (default: "
+                             "all of them)")
+  parser.add_argument("--only", action = "append", default = None,
+                      metavar = "PRIMITIVE",
+                      help = "time just this primitive, repeatable")
+  parser.add_argument("--positions", type = int, default = 200,
+                      help = "positions per stage in the corpus")
+  parser.add_argument("--repeats", type = int, default = 7,
+                      help = "timed passes over the corpus per primitive")
+  parser.add_argument("--seed", type = int, default = 0,
+                      help = "seed the corpus games are played from")
+  parser.add_argument("--save", metavar = "FILE",
+                      help = "save the corpus and results as a baseline")
+  parser.add_argument("--compare", metavar = "FILE",
+                      help = "time the baseline's corpus and fail if any "
+                             "primitive is slower than in the baseline")
+  parser.add_argument("--threshold", type = float, default = 0.2,
+                      help = "slowdown allowed by --compare, as a fraction "
+                             "of the baseline median")
+  parser.add_argument("--parity", type = int, metavar = "N", default = None,
+                      help = "instead of timing, check the NumPy heuristic "
+                             "table build against the scalar one for the "
+                             "default weights and N random ones")
+  args = parser.parse_args()
+
+  if args.parity is not None:
+    sys.exit(0 if parity(args.parity, args.seed) else 1)
+
+  imps = tuple(args.imp) if args.imp else tuple(engines.registry)
+  if args.compare:
+    boards, baseline = load(args.compare)
+  else:
+    print("Playing corpus games...")
+    boards = corpus(args.positions, args.seed)
+  print(f"Corpus: {len(boards['mid'])} mid-game and {len(boards['late'])} "
+        f"late-game positions")
+
+  results = run(boards, imps, args.repeats, args.only)
+
+  if args.save:
+    save(args.save, boards, results, args.seed)
+    print("Baseline saved to", args.save)
+  if args.compare:
+    print(f"Compared with {args.compare}:")
+    for key in results:
+      if key in baseline:
+        report(key, results[key], baseline[key])
+    slower = regressions(results, baseline, args.threshold)
+    if slower:
+      print(f"{len(slower)} primitives regressed by more than "
+            f"{args.threshold:.0%}:")
+      for key in slower:
+        print("  * ", key)
+      sys.exit(1)
+    print("No regressions")
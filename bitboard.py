@@ -1,4 +1,5 @@
-import random, board, itertools, math
+import random, board, itertools, math, os, mmap, struct, hashlib, json, numpy
+from array import array
 from functools import lru_cache
 
 """
@@ -13,19 +14,48 @@ class InvalidMoveDirection(Exception):
 class InvalidSpawnLocation(Exception):
   pass
 
+class InvalidWeights(Exception):
+  pass
+
 
 """
 Table initialization
+
+Tables are flat arrays indexed by the 16 bit value of a row. Building them
+takes around a second, so the results are written to a versioned cache file
+(the heuristic table is keyed by its weights) and later processes map that
+file into memory instead of recomputing it.
 """
 
-move_left_table = {}
-move_right_table = {}
-score_table = {}
-heuristic_table = {}
+move_left_table = array("H")
+move_right_table = array("H")
+score_table = array("I")
+# column form of the move tables: entry n is the result of moving the
+# transposed row n up (or down), laid out as the rightmost column of a board
+col_up_table = array("Q")
+col_down_table = array("Q")
+heuristic_table = array("d")
+# column form of the heuristic table: entry n is the value of the column whose
+# tiles are those of transposed row n, read from the bottom row up as columns
+# have always been read. Rows and columns aren't scored exactly alike, as the
+# table differs from its reversal in the last bit for some rows
+col_heuristic_table = array("d")
 loss_penalty = 0
 
+# the weights the heuristic table was last built with
 heuristic_weights = (3.5, 11, 4, 47, 700, 270, 200000)
 
+# bump whenever the layout or contents of the cached tables change
+TABLE_VERSION = 2
+TABLE_MAGIC = b"2048TBL\0"
+# header is the magic followed by the version, padded to 16 bytes so that
+# every table after it stays aligned
+TABLE_HEADER = struct.Struct("<8sI4x")
+
+table_cache_dir = os.environ.get(
+  "BITBOARD_CACHE_DIR",
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tables"))
+
 # special-case exponentiation where 2^0 = 0
 def exp(n):
   return 0 if n == 0 else 2 ** n
@@ -37,15 +67,77 @@ def row_to_bits(row):
   for n in row:
     # Shift over by a tile
     res <<= 4
-    # Or in the value for the current tile
-    res |= int(math.log(n, 2) if n != 0 else 0)
+    # Or in the value for the current tile, capped at 15 so that merging two
+    # 32768 tiles can't spill into the neighbouring tile
+    res |= min(int(math.log(n, 2) if n != 0 else 0), 15)
   return res
 
+"""
+Table cache helpers
+"""
+def table_path(name, weights = None):
+  if weights is None:
+    return os.path.join(table_cache_dir, f"{name}-v{TABLE_VERSION}.bin")
+  key = hashlib.sha1(repr(tuple(weights)).encode()).hexdigest()[:16]
+  return os.path.join(table_cache_dir, f"{name}-v{TABLE_VERSION}-{key}.bin")
+
+# writes the given arrays to path one after another behind the header. The
+# file is written to a temporary name first so concurrent readers never see
+# a partial table
+def save_tables(path, tables):
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+      f.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION))
+      for table in tables:
+        table.tofile(f)
+    os.replace(tmp, path)
+  except OSError:
+    # the cache is only an optimization, so an unwritable directory is fine
+    pass
+
+# maps a cache file written by save_tables into memory and returns a read-only
+# view per table, or None if the file is missing or stale. codes gives the
+# array typecode of each table, all of which hold 65536 entries
+def load_tables(path, codes):
+  try:
+    with open(path, "rb") as f:
+      mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+  except (OSError, ValueError):
+    return None
+  sizes = [array(code).itemsize * 0x10000 for code in codes]
+  if len(mm) != TABLE_HEADER.size + sum(sizes) or \
+     TABLE_HEADER.unpack_from(mm) != (TABLE_MAGIC, TABLE_VERSION):
+    mm.close()
+    return None
+  views = []
+  offset = TABLE_HEADER.size
+  for code, size in zip(codes, sizes):
+    views.append(memoryview(mm)[offset:offset + size].cast(code))
+    offset += size
+  return views
+
 """
 Create move tables
 """
+move_codes = ("H", "H", "I", "Q", "Q")
+
 def init_moves():
+  global move_left_table, move_right_table, score_table, col_up_table, \
+         col_down_table
+  path = table_path("moves")
+  tables = load_tables(path, move_codes)
+  if tables is None:
+    tables = build_moves()
+    save_tables(path, tables)
+  move_left_table, move_right_table, score_table, col_up_table, \
+    col_down_table = tables
+
+def build_moves():
   print("Generating bitboard move tables...")
+  left, right, scores, up, down = (
+    array(code, bytes(array(code).itemsize * 0x10000)) for code in move_codes)
   for vector in itertools.product(range(16), repeat = 4):
     # convert the vector into the corresponding 2 bytes representing that row
     row = 0
@@ -57,11 +149,24 @@ def init_moves():
     """ Move table creation """
     # define the tables of the row – merging operates on non-logs, so have
     # to exponentiate
-    new_vec_left, score_table[row] = board.merge([exp(n) for n in vector])
+    new_vec_left, scores[row] = board.merge([exp(n) for n in vector])
     new_vec_right = list(reversed(board.merge([exp(n) for n in reversed(vector)])[0]))
 
-    move_left_table[row] = row_to_bits(new_vec_left)
-    move_right_table[row] = row_to_bits(new_vec_right)
+    left[row] = row_to_bits(new_vec_left)
+    right[row] = row_to_bits(new_vec_right)
+
+    """ Column table creation """
+    # a transposed row holds a column top to bottom, so moving it left is
+    # moving the column up
+    up[row] = row_to_col(left[row])
+    down[row] = row_to_col(right[row])
+  return left, right, scores, up, down
+
+# spreads the 4 tiles of a row down the rightmost column of a board, first
+# tile at the top
+def row_to_col(row):
+  return ((row & 0xF000) << 36) | ((row & 0x0F00) << 24) | \
+         ((row & 0x00F0) << 12) | (row & 0x000F)
 
 
 # initiate heuristic table
@@ -74,9 +179,104 @@ def init_moves():
 #   idx 4: weight for smoothness
 #   idx 5: weight for empty tiles
 #   idx 6: loss penalty
-def init_heuristics(weights = heuristic_weights):
+# cache is False to build the table without reading or writing a cache file,
+# for weights that are only used once
+def init_heuristics(weights = heuristic_weights, cache = True):
+  global heuristic_table, col_heuristic_table, heuristic_weights
+  weights = tuple(weights)
+  path = table_path("heuristics", weights)
+  tables = load_tables(path, ("d",)) if cache else None
+  if tables is None:
+    tables = [build_heuristics(weights)]
+    if cache:
+      save_tables(path, tables)
+  heuristic_table, = tables
+  col_heuristic_table = build_col_heuristics(heuristic_table)
+  heuristic_weights = weights
+  # cached values were computed with the old table
+  heuristic_value.cache_clear()
+
+# the heuristic table indexed by transposed rows, whose tiles are in the
+# reverse of the order heuristic_value has always read columns in
+def build_col_heuristics(table):
+  rows = numpy.arange(0x10000)
+  reversed_rows = ((rows & 0xF) << 12) | (((rows >> 4) & 0xF) << 8) | \
+                  (((rows >> 8) & 0xF) << 4) | (rows >> 12)
+  res = array("d")
+  res.frombytes(numpy.frombuffer(table, dtype = numpy.float64)[reversed_rows]
+                .tobytes())
+  return res
+
+"""
+Builds the heuristic table with NumPy, working on all 65536 rows at once. Each
+term is built up in the same order, with the same float operations, as in
+build_heuristics_scalar, so the two tables are bit for bit the same.
+
+That relies on the powers of tile ranks being computed by Python, and on every
+value that Python would keep as an exact integer staying exact as a float.
+Weights big enough to break that are built by build_heuristics_scalar instead.
+"""
+def build_heuristics(weights = heuristic_weights):
+  supower, suweight, mpower, mweight, sweight, eweight, loss_penalty = weights
+  # Python's own powers, as the scalar version takes them
+  su_powers = [n ** supower for n in range(16)]
+  m_powers = [n ** mpower for n in range(16)]
+  bound = (4 * max(map(abs, su_powers)) + 8) * abs(suweight) + \
+          3 * max(map(abs, m_powers)) * abs(mweight) + \
+          4 * abs(eweight) + abs(sweight) + abs(loss_penalty)
+  if not bound < 2 ** 53:
+    return build_heuristics_scalar(weights)
+
+  print("Generating bitboard heuristics...")
+  rows = numpy.arange(0x10000)
+  # the tiles of every row, first (leftmost) tile first
+  vector = [(rows >> shift) & 0xF for shift in (12, 8, 4, 0)]
+  su_powers = numpy.array(su_powers, dtype = numpy.float64)
+  m_powers = numpy.array(m_powers, dtype = numpy.float64)
+
+  # score tile values and emptiness
+  sum = su_powers[vector[0]] + su_powers[vector[1]] + \
+        su_powers[vector[2]] + su_powers[vector[3]]
+  empty = (vector[0] == 0).astype(numpy.int64) + (vector[1] == 0) + \
+          (vector[2] == 0) + (vector[3] == 0)
+
+  # score smoothness
+  counter = numpy.zeros(0x10000, dtype = numpy.int64)
+  for i in range(3):
+    same = vector[i] == vector[i+1]
+    sum = numpy.where(~same & (counter > 0), sum + (1 + counter), sum)
+    counter = numpy.where(same, counter + 1, 0)
+  sum = numpy.where(counter > 0, sum + (1 + counter), sum)
+
+  # score monotonicity
+  mono_left = numpy.zeros(0x10000)
+  mono_right = numpy.zeros(0x10000)
+  for i in range(3):
+    a, b = m_powers[vector[i]], m_powers[vector[i+1]]
+    falling = vector[i] > vector[i+1]
+    mono_left = numpy.where(falling, mono_left + (a - b), mono_left)
+    mono_right = numpy.where(falling, mono_right, mono_right + (b - a))
+  # min() keeps the first of two equal values
+  mono = numpy.where(mono_right < mono_left, mono_right, mono_left)
+
+  # smoothness is folded into sum above, so its own term is always 0
+  smoothness = 0
+  res = float(loss_penalty) + empty * eweight - \
+        smoothness * sweight - \
+        mono * mweight - \
+        sum * suweight
+  table = array("d")
+  table.frombytes(res.astype(numpy.float64).tobytes())
+  return table
+
+"""
+Builds the heuristic table one row at a time. The reference for
+build_heuristics, which is checked against it by heuristics_parity
+"""
+def build_heuristics_scalar(weights = heuristic_weights):
   print("Generating bitboard heuristics...")
   supower, suweight, mpower, mweight, sweight, eweight, loss_penalty = weights
+  table = array("d", bytes(8 * 0x10000))
   for vector in itertools.product(range(16), repeat = 4):
 
     """
@@ -115,40 +315,89 @@ def init_heuristics(weights = heuristic_weights):
       else:
         mono_right += vector[i+1] ** mpower - vector[i] ** mpower
 
-    heuristic_table[row] = loss_penalty + \
-                           empty * eweight - \
-                           smoothness * sweight - \
-                           min(mono_left, mono_right) * mweight - \
-                           sum * suweight
+    table[row] = loss_penalty + \
+                 empty * eweight - \
+                 smoothness * sweight - \
+                 min(mono_left, mono_right) * mweight - \
+                 sum * suweight
+  return table
+
+"""
+Returns the number of rows where build_heuristics and build_heuristics_scalar
+differ in any bit for the given weights
+"""
+def heuristics_parity(weights = heuristic_weights):
+  fast = numpy.frombuffer(build_heuristics(weights), dtype = numpy.uint64)
+  slow = numpy.frombuffer(build_heuristics_scalar(weights),
+                          dtype = numpy.uint64)
+  return int((fast != slow).sum())
 
+"""
+Weights files hold a JSON object whose "weights" are a list of the 7 heuristic
+weights, alongside anything else the writer wants to note about them
+"""
+def load_weights(path):
+  with open(path) as f:
+    weights = json.load(f).get("weights")
+  if not isinstance(weights, list) or len(weights) != len(heuristic_weights):
+    raise InvalidWeights(path)
+  return tuple(weights)
+
+def save_weights(path, weights, **info):
+  tmp = f"{path}.{os.getpid()}.tmp"
+  with open(tmp, "w") as f:
+    json.dump({"weights": list(weights), **info}, f, indent = 1)
+  os.replace(tmp, path)
+
+# weights is either the heuristic weights or the path of a weights file
 def init(weights=heuristic_weights):
+  if isinstance(weights, str):
+    weights = load_weights(weights)
   init_moves()
   init_heuristics(weights)
 
 @lru_cache(maxsize = 1000000)
 def heuristic_value(board):
-  total_value = 0
-  # do rows
-  for offset in (0, 16, 32, 48):
-    total_value += heuristic_table[(board >> offset) & 0xFFFF]
-  # do columns
-  for n in range(4):
-    cur_col = 0
-    for offset in (0, 16, 32, 48):
-      # shift to the current tile
-      cur_col <<= 4
-      # or in the value of the tile at col index n
-      cur_col |= (board >> (offset + 4 * n)) & 0xF
-    total_value += heuristic_table[cur_col]
-  return total_value
-
-
-
-
-
-
-
+  # rows of the transpose are the columns of the board
+  t = transpose(board)
+  return heuristic_table[board & 0xFFFF] + \
+         heuristic_table[(board >> 16) & 0xFFFF] + \
+         heuristic_table[(board >> 32) & 0xFFFF] + \
+         heuristic_table[board >> 48] + \
+         col_heuristic_table[t & 0xFFFF] + \
+         col_heuristic_table[(t >> 16) & 0xFFFF] + \
+         col_heuristic_table[(t >> 32) & 0xFFFF] + \
+         col_heuristic_table[t >> 48]
+"""
+Incremental heuristic evaluation
+
+A spawn changes one row and one column of a board, so the heuristic of each
+board spawned from the same parent can be had by looking up just those two
+lines again. heuristic_lines gives the parent's 8 lines - the 4 rows and then
+the 4 rows of its transpose, as heuristic_value reads them - with the table
+value of each, and spawn_heuristic scores a spawn from them. The values are
+summed in the same order as heuristic_value, so the result is exactly the same.
+"""
+def heuristic_lines(board):
+  t = transpose(board)
+  lines = (board & 0xFFFF, (board >> 16) & 0xFFFF, (board >> 32) & 0xFFFF,
+           board >> 48, t & 0xFFFF, (t >> 16) & 0xFFFF, (t >> 32) & 0xFFFF,
+           t >> 48)
+  return lines, [heuristic_table[line] for line in lines[:4]] + \
+                [col_heuristic_table[line] for line in lines[4:]]
 
+"""
+Returns heuristic_value of the board with lines and values from
+heuristic_lines after a tile with the given log value spawns at pos
+"""
+def spawn_heuristic(lines, values, pos, tile):
+  # tile pos is tile pos & 3 of row pos >> 2, and tile pos >> 2 of transposed
+  # row pos & 3
+  r, c = pos >> 2, pos & 3
+  v = values[:]
+  v[r] = heuristic_table[lines[r] | (tile << (c << 2))]
+  v[4 + c] = col_heuristic_table[lines[4 + c] | (tile << (r << 2))]
+  return v[0] + v[1] + v[2] + v[3] + v[4] + v[5] + v[6] + v[7]
 
 # boards are represented as an integer of up to 64 bits
 # every four bits is the log of the value of a cell - first four bits are the
@@ -163,15 +412,48 @@ def equal(b1, b2):
   return b1 == b2
 
 """
-Return a list of ints corresponding to the points where empty tiles begin.
+Returns a mask with the lowest bit of every empty tile's nibble set, found
+for all 16 tiles at once by folding each nibble's bits down onto its lowest
+"""
+def empty_mask(board):
+  x = board | (board >> 1)
+  x |= x >> 2
+  return ~x & 0x1111111111111111
+
+"""
+Returns the number of empty tiles on board
+"""
+def count_empty(board):
+  # multiplying adds every nibble of the mask into the top nibble, which
+  # only overflows when all 16 tiles are empty
+  if board == 0: return 16
+  return ((empty_mask(board) * 0x1111111111111111) & 0xFFFFFFFFFFFFFFFF) >> 60
+
+"""
+Squeezes the mask from empty_mask down to 16 bits, bit n set if tile n is
+empty
+"""
+def compress_mask(mask):
+  mask = (mask | (mask >> 3)) & 0x0303030303030303
+  mask = (mask | (mask >> 6)) & 0x000F000F000F000F
+  mask = (mask | (mask >> 12)) & 0x000000FF000000FF
+  return (mask | (mask >> 24)) & 0xFFFF
+
+# the positions set in every 8 bit half of a compressed mask, for the low and
+# high halves
+empty_low_table = tuple(tuple(n for n in range(8) if m >> n & 1)
+                        for m in range(256))
+empty_high_table = tuple(tuple(n + 8 for n in positions)
+                         for positions in empty_low_table)
+
+"""
+Return a tuple of ints corresponding to the points where empty tiles begin.
 Works right to left, i.e. 0 means the bottom right tile is empty, 1 means
 the second-from right tile in the bottom row is empty, etc.
 """
 def empty_tiles(board):
-  empty_pos = []
-  for cur_pos in range(16):
-    if not ((board >> (cur_pos * 4)) & 0xF): empty_pos.append(cur_pos)
-  return empty_pos
+  mask = compress_mask(empty_mask(board))
+  return empty_low_table[mask & 0xFF] + empty_high_table[mask >> 8]
 
 """
 Returns board with a tile randomly spawned.
@@ -187,67 +469,166 @@ def spawn_tile(board):
 
 def spawn_manual(board, value, loc):
   real_value = int(math.log(value, 2))
-  return board | (value << (4 * loc))
+  return board | (real_value << (4 * loc))
+
+"""
+Returns the transpose of a board, so that row n of the result is column n of
+the board read top to bottom
+"""
+def transpose(board):
+  a1 = board & 0xF0F00F0FF0F00F0F
+  a2 = board & 0x0000F0F00000F0F0
+  a3 = board & 0x0F0F00000F0F0000
+  a = a1 | (a2 << 12) | (a3 >> 12)
+  b1 = a & 0xFF00FF0000FF00FF
+  b2 = a & 0x00FF00FF00000000
+  b3 = a & 0x00000000FF00FF00
+  return b1 | (b2 >> 24) | (b3 << 24)
+
+"""
+Returns board mirrored left to right
+"""
+def flip_h(board):
+  board = ((board & 0x0F0F0F0F0F0F0F0F) << 4) | \
+          ((board >> 4) & 0x0F0F0F0F0F0F0F0F)
+  return ((board & 0x00FF00FF00FF00FF) << 8) | \
+         ((board >> 8) & 0x00FF00FF00FF00FF)
+
+"""
+Returns board mirrored top to bottom
+"""
+def flip_v(board):
+  return ((board & 0xFFFF) << 48) | (((board >> 16) & 0xFFFF) << 32) | \
+         (((board >> 32) & 0xFFFF) << 16) | (board >> 48)
+
+directions = ("L", "R", "U", "D")
+
+"""
+Symmetries
+
+The 8 rotations and reflections of a board are numbered 0-7 by the steps that
+produce them, applied in this order: bit 0 flips left to right, bit 1 flips
+top to bottom and bit 2 transposes.
+"""
+
+# how each step changes the direction of a move
+flip_h_dirs = {"L": "R", "R": "L", "U": "U", "D": "D"}
+flip_v_dirs = {"L": "L", "R": "R", "U": "D", "D": "U"}
+transpose_dirs = {"L": "U", "R": "D", "U": "L", "D": "R"}
+
+def transform_dir(transform, dir):
+  if transform & 1: dir = flip_h_dirs[dir]
+  if transform & 2: dir = flip_v_dirs[dir]
+  if transform & 4: dir = transpose_dirs[dir]
+  return dir
+
+def untransform_dir(transform, dir):
+  if transform & 4: dir = transpose_dirs[dir]
+  if transform & 2: dir = flip_v_dirs[dir]
+  if transform & 1: dir = flip_h_dirs[dir]
+  return dir
+
+# symmetry_dirs[t][dir] is the direction on the transformed board that matches
+# dir on the original, and unsymmetry_dirs[t] maps it back
+symmetry_dirs = tuple({dir: transform_dir(t, dir) for dir in directions}
+                      for t in range(8))
+unsymmetry_dirs = tuple({dir: untransform_dir(t, dir) for dir in directions}
+                        for t in range(8))
+
+"""
+Returns board transformed by the given symmetry
+"""
+def transform(board, transform):
+  if transform & 1: board = flip_h(board)
+  if transform & 2: board = flip_v(board)
+  if transform & 4: board = transpose(board)
+  return board
+
+# symmetry_positions[t][pos] is the position that the tile at pos moves to
+# under symmetry t, and unsymmetry_positions[t] maps it back
+symmetry_positions = tuple(
+  tuple((transform(1 << (4 * pos), t).bit_length() - 1) // 4
+        for pos in range(16))
+  for t in range(8))
+unsymmetry_positions = tuple(
+  tuple(positions.index(pos) for pos in range(16))
+  for positions in symmetry_positions)
+
+"""
+Returns the smallest of the 8 symmetric forms of board, which all play the
+same, along with the symmetry that produces it
+"""
+def canonical(board):
+  h = flip_h(board)
+  v = flip_v(board)
+  hv = flip_v(h)
+  return min((board, 0), (h, 1), (v, 2), (hv, 3),
+             (transpose(board), 4), (transpose(h), 5), (transpose(v), 6),
+             (transpose(hv), 7))
 
 """
 Returns board moved in the given direction - L, R, U, or D, along with the
 increase in score for moving in that direction
 """
 def move(board, dir):
-  res = 0
-  score_inc = 0
-  if dir == "L":
-    for offset in (0, 16, 32, 48):
-      cur_row = (board >> offset) & 0xFFFF
-      res |= move_left_table[cur_row] << offset
-      score_inc += score_table[cur_row]
-
-  elif dir == "R":
-    for offset in (0, 16, 32, 48):
-      cur_row = (board >> offset) & 0xFFFF
-      res |= move_right_table[cur_row] << offset
-      score_inc += score_table[cur_row]
-
-  elif dir == "U":
-
-    for n in range(4):
-      cur_col = 0
-      for offset in (0, 16, 32, 48):
-        # shift to the current tile
-        cur_col <<= 4
-        # or in the value of the tile at col index n
-        cur_col |= (board >> (offset + 4 * n)) & 0xF
-      # look up the replacement for the current column
-      replacement_col = move_right_table[cur_col]
-      # increment the score
-      score_inc += score_table[cur_col]
-      # or the replacement column into res
-      for offset in (0, 16, 32, 48):
-        # 48 - offset + adjust because the col has to put back in reverse
-        res |= ((replacement_col >> (int(offset / 4))) & 0xF) << (48 - offset + 4 * n)
-
-  elif dir == "D":
-    for n in range(4):
-      cur_col = 0
-      for offset in (0, 16, 32, 48):
-        # shift to the current tile
-        cur_col <<= 4
-        # or in the value of the tile at col index n
-        cur_col |= (board >> (offset + 4 * n)) & 0xF
-      # look up the replacement for the current column
-      replacement_col = move_left_table[cur_col]
-      # increment the score
-      score_inc += score_table[cur_col]
-      # or the replacement column into res
-      for offset in (0, 16, 32, 48):
-        # 48 - offset + adjust because the col has to put back in reverse
-        res |= ((replacement_col >> (int(offset / 4))) & 0xF) << (48 - offset + 4 * n)
+  if dir == "L" or dir == "R":
+    r0 = board & 0xFFFF
+    r1 = (board >> 16) & 0xFFFF
+    r2 = (board >> 32) & 0xFFFF
+    r3 = board >> 48
+    table = move_left_table if dir == "L" else move_right_table
+    return (table[r0] | (table[r1] << 16) | (table[r2] << 32) |
+            (table[r3] << 48),
+            score_table[r0] + score_table[r1] + score_table[r2] +
+            score_table[r3])
+
+  elif dir == "U" or dir == "D":
+    # columns of the board are the rows of its transpose, which the column
+    # tables put straight back into place
+    t = transpose(board)
+    c0 = t & 0xFFFF
+    c1 = (t >> 16) & 0xFFFF
+    c2 = (t >> 32) & 0xFFFF
+    c3 = t >> 48
+    table = col_up_table if dir == "U" else col_down_table
+    return (table[c0] | (table[c1] << 4) | (table[c2] << 8) |
+            (table[c3] << 12),
+            score_table[c0] + score_table[c1] + score_table[c2] +
+            score_table[c3])
 
   else:
     # invalid direction given, raise an exception with the given direction
     raise InvalidMoveDirection(dir)
 
-  return res, score_inc
+"""
+Returns the (board, score increase) pair for each direction in the order of
+directions, sharing the row and column lookups between them
+"""
+def move_all(board):
+  r0 = board & 0xFFFF
+  r1 = (board >> 16) & 0xFFFF
+  r2 = (board >> 32) & 0xFFFF
+  r3 = board >> 48
+  t = transpose(board)
+  c0 = t & 0xFFFF
+  c1 = (t >> 16) & 0xFFFF
+  c2 = (t >> 32) & 0xFFFF
+  c3 = t >> 48
+  # merges score the same whichever way the row is moved
+  row_score = score_table[r0] + score_table[r1] + score_table[r2] + \
+              score_table[r3]
+  col_score = score_table[c0] + score_table[c1] + score_table[c2] + \
+              score_table[c3]
+  left, right, up, down = move_left_table, move_right_table, col_up_table, \
+                          col_down_table
+  return ((left[r0] | (left[r1] << 16) | (left[r2] << 32) | (left[r3] << 48),
+           row_score),
+          (right[r0] | (right[r1] << 16) | (right[r2] << 32) |
+           (right[r3] << 48), row_score),
+          (up[c0] | (up[c1] << 4) | (up[c2] << 8) | (up[c3] << 12),
+           col_score),
+          (down[c0] | (down[c1] << 4) | (down[c2] << 8) | (down[c3] << 12),
+           col_score))
 
 """
 Returns True if no further moves are possible and False otherwise
@@ -258,9 +639,9 @@ def game_over(board):
 
   # for speed, check if the board is empty first: quicker than moving
   # in all four directions
-  if len(empty_tiles(board)) > 0: return False
-  for dir in ("L", "R", "U", "D"):
-    if (move(board, dir))[0] != board: return False
+  if empty_mask(board): return False
+  for res, _ in move_all(board):
+    if res != board: return False
   # board is full and no moves are possible – game is over
   return True
 
@@ -290,3 +671,19 @@ def string_of_board(board):
     state_string += "\n" + row_div
   # trim trailing newline
   return state_string[:-1]
+
+"""
+Converts the board to and from the 2d lists of tile values used by board
+"""
+def to_list(board):
+  return [[0 if (board >> offset + i) & 0xF == 0
+           else 2**((board >> offset + i) & 0xF)
+           for i in (12, 8, 4, 0)]
+          for offset in (48, 32, 16, 0)]
+
+def from_list(rows):
+  res = 0
+  for row in rows:
+    for tile in row:
+      res = (res << 4) | (0 if tile == 0 else int(math.log2(tile)))
+  return res
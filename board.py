@@ -136,6 +136,15 @@ def move(board, dir):
     # invalid direction given, raise an exception with the given direction
     raise InvalidMoveDirection(dir)
 
+directions = ("L", "R", "U", "D")
+
+"""
+Returns the (board, score increase) pair for each direction in the order of
+directions
+"""
+def move_all(board):
+  return tuple(move(board, dir) for dir in directions)
+
 """
 Returns True if no further moves are possible and False otherwise
 """
@@ -151,6 +160,16 @@ def game_over(board):
   # board is full and no moves are possible – game is over
   return True
 
+"""
+Converts the board to and from 2d lists of tile values. Boards already are
+such lists, so these just copy them
+"""
+def to_list(board):
+  return [list(row) for row in board]
+
+def from_list(rows):
+  return [list(row) for row in rows]
+
 """
 Converts the board state to string format
 """
@@ -1,6 +1,7 @@
 #!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
-import bitboard, getch, os, minimax, expectimax, sys, random, board
-from functools import lru_cache
+import bitboard, getch, os, minimax, expectimax, sys, random, board, \
+       transposition, deepening, parallel, montecarlo, stats, time, \
+       fastboard, star
 
 directions = {
   'w': "U",
@@ -9,69 +10,245 @@ directions = {
   'd': "R"
 }
 
-# run an iteration of the game until it ends in the given mode
-def run_iteration(mode, imp, depth, prints = True, debug = False):
+# searches return the chosen move along with the engine's full result, and
+# record themselves in search_stats if it's given
+def minimax_search(state, depth, imp, order = None, search_stats = None):
+  res = minimax.maximize(state, depth, -float("inf"), float("inf"), imp, order,
+                         search_stats)
+  return res[0], res
+
+# searches spread over worker processes aren't recorded in search_stats
+# plain bitboard searches run compiled when fastboard is available, or with
+# star_pruning, as Star1 searches, which skip the table but search fewer nodes
+def expectimax_search(state, depth, imp, table = None, cutoff = 0.0,
+                      max_spawns = None, order = None, workers = None,
+                      search_stats = None, star_pruning = False):
+  if workers is not None and imp == bitboard:
+    value, move, _ = parallel.parallel_expectimax(state, depth, workers, cutoff,
+                                                  max_spawns, order)
+    return move, (value, move)
+  if imp == bitboard and not cutoff and max_spawns is None and \
+     search_stats is None:
+    if star_pruning:
+      res = star.search(state, depth, order)
+    else:
+      res = fastboard.search(state, depth, table, order)
+    return res[1], res
+  res = expectimax.expectimax(state, depth, imp, table, cutoff = cutoff,
+                              max_spawns = max_spawns, order = order,
+                              stats = search_stats)
+  return res[1], res
+
+"""
+Returns a new game: an empty board with two tiles spawned on it
+"""
+def new_game(imp):
   main = imp.new_board()
-  total_score = 0
   for n in range(2): main = imp.spawn_tile(main)
+  return main
+
+# searched positions are kept for the whole game so each search can reuse the
+# work of the ones before it. symmetric keys the table on canonical boards
+def new_table(imp, symmetric = False):
+  if imp == bitboard:
+    return transposition.TranspositionTable(symmetric = symmetric)
+  return None
+
+"""
+Returns the move mode makes from state, along with the (position, value)
+spawn it wants to follow the move in minimax_antagonistic mode, or None to
+spawn a random tile
+"""
+# table is the transposition table from new_table that expectimax searches use
+# cutoff and max_spawns are passed on to expectimax to prune unlikely branches
+# if ms_per_move is given, searches deepen iteratively until that many
+# milliseconds have passed, treating depth as the maximum depth
+# if workers is given, bitboard expectimax searches are spread over that many
+# processes
+# playouts, horizon and guided configure the montecarlo mode, which ignores
+# depth
+# if stats_log is given, a stats.SearchStats for each search is appended to it
+# star_pruning makes plain bitboard expectimax searches Star1 searches
+def choose_move(mode, imp, state, depth, table = None, cutoff = 0.0,
+                max_spawns = None, ms_per_move = None, workers = None,
+                playouts = 100, horizon = 20, guided = False,
+                stats_log = None, star_pruning = False):
+  if mode == "minimax_random" or mode == "minimax_antagonistic" or \
+     mode == "expectimax":
+    search_stats = None
+    if stats_log is not None:
+      search_stats = stats.SearchStats()
+      # only bitboard caches its heuristic
+      cache_info = getattr(imp.heuristic_value, "cache_info", None)
+      if cache_info is not None:
+        cache_before = cache_info()
+      start = time.perf_counter()
+
+    if mode == "expectimax":
+      search = lambda d, order: expectimax_search(state, d, imp, table,
+                                                  cutoff, max_spawns,
+                                                  order, workers,
+                                                  search_stats, star_pruning)
+    else:
+      search = lambda d, order: minimax_search(state, d, imp, order,
+                                               search_stats)
+
+    if ms_per_move is None:
+      move, result = search(depth, None)
+      reached = depth
+    else:
+      move, result, reached = deepening.iterative_deepening(
+        search, imp.directions, ms_per_move, depth)
+
+    if search_stats is not None:
+      search_stats.elapsed = time.perf_counter() - start
+      search_stats.depth = reached
+      if cache_info is not None:
+        search_stats.heuristic_cache(cache_before, cache_info())
+      stats_log.append(search_stats)
+    if mode == "minimax_antagonistic":
+      return move, result[2]
+    return move, None
+  elif mode == "montecarlo":
+    _, move = montecarlo.montecarlo(state, imp, playouts, horizon, guided)
+    return move, None
+  elif mode == "random":
+    return random.choice(["L", "R", "U", "D"]), None
+  elif mode == "manual":
+    m = getch.getch()
+    while m not in ['w', 'a', 's', 'd']:
+      m = getch.getch()
+    return directions[m], None
+
+"""
+Makes move on state and spawns a tile after it, the given (position, value)
+spawn if there is one and a random one otherwise. Returns the new state and
+the increase in score, or None if the move doesn't change the board
+"""
+# if recorder is given, the move is written to it as a replay.Recorder
+def step(imp, state, move, spawn = None, recorder = None):
+  img, score_inc = imp.move(state, move)
 
+  # if no change happened, don't update the score or try to spawn a tile
+  if imp.equal(img, state):
+    return None
+
+  if spawn is not None:
+    res = imp.spawn_manual(img, spawn[1], spawn[0])
+  else:
+    res = imp.spawn_tile(img)
+  if recorder is not None:
+    recorder.record(state, move, img, res, score_inc)
+  return res, score_inc
+
+"""
+What play_game yields for each move it makes, and once for the start of the
+game with direction None. board is the board after the move and its spawn,
+score_inc the score the move made and score the game's score after it.
+nodes and playout_moves are the search nodes and Monte-Carlo playout moves
+spent choosing the move, and stats its stats.SearchStats if choose_move was
+given a stats_log. seconds is the time taken by the move and elapsed the time
+since the game started. over is set on the last event of a finished game
+"""
+class MoveEvent:
+
+  def __init__(self, board, direction, score_inc, score, moves, nodes = 0,
+               playout_moves = 0, stats = None, seconds = 0.0,
+               elapsed = 0.0, over = False):
+    self.board = board
+    self.direction = direction
+    self.score_inc = score_inc
+    self.score = score
+    # moves made so far, this one included
+    self.moves = moves
+    self.nodes = nodes
+    self.playout_moves = playout_moves
+    self.stats = stats
+    self.seconds = seconds
+    self.elapsed = elapsed
+    self.over = over
+
+"""
+Plays a game in the given mode, yielding a MoveEvent as each move is made, so
+a consumer can watch, log or stop the game as it goes. Closing the generator
+stops the game
+"""
+# table is the transposition table to search with, a new one from new_table
+# if None, which symmetric is passed on to
+# if recorder is given, the game is written to it as a replay.Recorder
+# the rest of the options are passed on to choose_move
+def play_game(mode, imp, depth, table = None, symmetric = False,
+              recorder = None, **options):
+  main = new_game(imp)
+  total_score = 0
   move_count = 0
+  if recorder is not None:
+    recorder.start_game(main)
+  if table is None:
+    table = new_table(imp, symmetric)
+  stats_log = options.get("stats_log")
+  # minimax's move ordering and cached bounds carry over between searches, and
+  # both can decide between equal moves and spawns, so each game starts
+  # without them to play the same whatever was played before it
+  minimax.reset_ordering()
+  minimax.clear_cache()
 
-  if imp == bitboard:
-      dec = lru_cache(maxsize = 1000000)
-      minimax.maximize = dec(minimax.maximize)
-      minimax.minimize = dec(minimax.minimize)
-      expectimax.expectimax = dec(expectimax.expectimax)
+  start = time.perf_counter()
+  over = imp.game_over(main)
+  yield MoveEvent(main, None, 0, 0, 0, over = over)
+  while not over:
+    # moves that don't change the board count towards the next one
+    move_start = time.perf_counter()
+    nodes = expectimax.nodes + minimax.nodes
+    playout_moves = montecarlo.playout_moves
+    logged = None if stats_log is None else len(stats_log)
+    res = None
 
-  try:
-    while not imp.game_over(main):
+    while res is None:
+      move, spawn = choose_move(mode, imp, main, depth, table, **options)
+      res = step(imp, main, move, spawn, recorder)
+
+    main, score_inc = res
+    move_count += 1
+    total_score += score_inc
+    over = imp.game_over(main)
+    now = time.perf_counter()
+    yield MoveEvent(main, move, score_inc, total_score, move_count,
+                    expectimax.nodes + minimax.nodes - nodes,
+                    montecarlo.playout_moves - playout_moves,
+                    None if logged is None or len(stats_log) == logged else
+                    stats_log[-1],
+                    now - move_start, now - start, over)
 
-      if prints:
+# run an iteration of the game until it ends in the given mode
+# if debug is set, the heuristic value of each board and the table's stats
+# are printed along with it
+# the rest of the options are passed on to play_game
+def run_iteration(mode, imp, depth, prints = True, debug = False,
+                  symmetric = False, **options):
+  table = new_table(imp, symmetric)
+  event = None
+
+  try:
+    for event in play_game(mode, imp, depth, table, **options):
+      if prints and not event.over:
         os.system('clear')
-        print(imp.string_of_board(main))
-        print("Score: " + str(total_score))
+        print(imp.string_of_board(event.board))
+        print("Score: " + str(event.score))
         if debug:
-          print(f"Board heuristic score: {imp.heuristic_value(main)}")
-
-      if mode == "minimax_random" or mode == "minimax_antagonistic":
-        (move, _, min_input) = minimax.maximize(main, depth, -float("-inf"), float("inf"), imp)
-      elif mode == "expectimax":
-        _, move = expectimax.expectimax(main, depth, imp)
-      elif mode == "random":
-        move = random.choice(["L", "R", "U", "D"])
-      elif mode == "manual":
-        m = getch.getch()
-        while m not in ['w', 'a', 's', 'd']:
-          m = getch.getch()
-        move = directions[m]
-
-      img,score_inc = imp.move(main, move)
-
-      # if no change happened, don't update the score or try to spawn a tile
-      if imp.equal(img, main):
-        continue
-
-      main = img
-      move_count += 1
-
-      total_score += score_inc
-      if mode == "minimax_antagonistic":
-        if min_input[1] == 2:
-          main = imp.spawn_manual(img, 2, min_input[0])
-        else:
-          main = imp.spawn_manual(img, 4, min_input[0])
-      else:
-        main = imp.spawn_tile(main)
+          print(f"Board heuristic score: {imp.heuristic_value(event.board)}")
+          if table is not None:
+            print(f"Transposition table: {table.stats()}")
 
   finally:
-    if prints:
+    if prints and event is not None:
       print("\r\n")
-      print(imp.string_of_board(main))
+      print(imp.string_of_board(event.board))
 
   if prints:
     print("\r\n")
 
-  return main, move_count, total_score, imp.max_tile(main)
+  return event.board, event.moves, event.score, imp.max_tile(event.board)
 
 if __name__ == "__main__":
   print("Loading game...")
@@ -88,6 +265,7 @@ if __name__ == "__main__":
   # or watches two AIs battle it out.
   print("a: use a minimax strategy with antagonistic spawning")
   print("e: use an expectimax strategy")
+  print("m: use a Monte-Carlo rollout strategy")
 
   c = ''
   while c not in ['w', 'm', 'e', 'r', 'a']:
@@ -100,6 +278,8 @@ if __name__ == "__main__":
       mode, depth = ("minimax_antagonistic", 7)
     elif c == 'e':
       mode, depth = ("expectimax", 3)
+    elif c == 'm':
+      mode, depth = ("montecarlo", 0)
 
   main, _, total_score, _ = run_iteration(mode, bitboard, depth)
 
@@ -0,0 +1,59 @@
+import time
+
+"""
+Custom exceptions
+"""
+class SearchTimeout(Exception):
+  pass
+
+"""
+Iterative deepening
+
+Searches are run at depth 1, 2, 3, ... until a per-move time budget runs out,
+and the move from the deepest search that finished is played. The engines call
+check() at every node, which raises SearchTimeout once the deadline set by
+iterative_deepening has passed so that the unfinished search is abandoned.
+"""
+
+# time.monotonic() value after which searches are abandoned, or None when no
+# deadline is set. Kept at module level rather than passed down the search so
+# that it doesn't become part of the engines' cache keys
+deadline = None
+
+def check():
+  if deadline is not None and time.monotonic() > deadline:
+    raise SearchTimeout()
+
+"""
+Returns the moves in directions with best moved to the front, so the move that
+was best at the previous depth is searched first
+"""
+def order_moves(directions, best):
+  if best is None:
+    return directions
+  return (best,) + tuple(d for d in directions if d != best)
+
+"""
+Runs search at increasing depths until ms_per_move milliseconds have passed or
+max_depth has been searched. search is called as search(depth, order), where
+order is the tuple of directions to try first at the root, and must return a
+(move, result) pair. Returns the (move, result) pair of the deepest completed
+search along with that depth.
+
+Depth 1 is always searched to completion so there is a move to return.
+"""
+def iterative_deepening(search, directions, ms_per_move, max_depth = None):
+  global deadline
+  start = time.monotonic()
+  move, result = search(1, directions)
+  depth = 1
+  deadline = start + ms_per_move / 1000
+  try:
+    while move is not None and (max_depth is None or depth < max_depth):
+      move, result = search(depth + 1, order_moves(directions, move))
+      depth += 1
+  except SearchTimeout:
+    pass
+  finally:
+    deadline = None
+  return move, result, depth
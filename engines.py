@@ -0,0 +1,188 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import random, argparse, sys, board, bitboard, npboard
+
+"""
+Board implementations
+
+The searches, the client and the timing scripts work with any module that
+provides these, whatever it uses to represent a board:
+
+  new_board()                   an empty board
+  init(weights)                 loads any tables; weights are optional
+  directions                    ("L", "R", "U", "D")
+  move(state, dir)              (new_state, score_inc)
+  move_all(state)               move for each direction in directions order
+  equal(b1, b2)                 whether two boards hold the same tiles
+  empty_tiles(state)            the positions of the empty tiles
+  spawn_manual(state, n, loc)   state with a tile of value n (2 or 4) at loc
+  spawn_tile(state)             state with a random tile spawned
+  game_over(state)              whether no move changes the board
+  max_tile(state)               the value of the largest tile
+  heuristic_value(state)        the implementation's evaluation of state
+  string_of_board(state)        the board drawn as text
+  from_list(rows), to_list(state)
+                                conversion from and to 4x4 lists of tile values
+
+Boards and positions are opaque: positions are only ever taken from
+empty_tiles and handed back to spawn_manual, so they can be (row, column)
+tuples, bit offsets or anything else. Tile values passed in and returned are
+always the values shown on the board, never their logs. Each implementation
+keeps its own heuristic, so heuristic values aren't comparable between them.
+
+An implementation that can't play every mode lists the ones it can as modes.
+
+Implementations are registered by name, which is how timing.py, bench.py and
+orchestrator.py find them. conformance checks that implementations move,
+spawn and score exactly as board does on random boards, and can be run with
+--conformance.
+"""
+
+class InvalidEngine(Exception):
+  pass
+
+required = ("new_board", "init", "directions", "move", "move_all", "equal",
+            "empty_tiles", "spawn_manual", "spawn_tile", "game_over",
+            "max_tile", "heuristic_value", "string_of_board", "from_list",
+            "to_list")
+
+all_modes = ("minimax_random", "minimax_antagonistic", "expectimax",
+             "montecarlo", "random", "manual")
+
+registry = {}
+
+def register(name, imp):
+  missing = [attr for attr in required if not hasattr(imp, attr)]
+  if missing:
+    raise InvalidEngine(f"{name} is missing {', '.join(missing)}")
+  if tuple(imp.directions) != ("L", "R", "U", "D"):
+    raise InvalidEngine(f"{name} has directions {imp.directions}")
+  registry[name] = imp
+  return imp
+
+def get(name):
+  try:
+    return registry[name]
+  except KeyError:
+    raise InvalidEngine(f"no implementation named {name}") from None
+
+# the name imp is registered under
+def name_of(imp):
+  for name, registered in registry.items():
+    if registered is imp:
+      return name
+  raise InvalidEngine(f"{imp.__name__} isn't registered")
+
+def modes(imp):
+  return getattr(imp, "modes", all_modes)
+
+def supports(imp, mode):
+  return mode in modes(imp)
+
+register("board", board)
+register("bitboard", bitboard)
+register("npboard", npboard)
+
+"""
+Conformance
+"""
+# a random board as a list, with full boards where nothing can move mixed in so
+# that game_over gets tested both ways
+def random_list(rng):
+  if rng.random() < 0.1:
+    return [[2 ** (1 + (x + y) % 2 + 2 * rng.randrange(5)) for y in range(4)]
+            for x in range(4)]
+  return [[0 if rng.random() < 0.35 else 2 ** rng.randint(1, 12)
+           for _ in range(4)] for _ in range(4)]
+
+# the list boards of every spawn on state, sorted so that implementations
+# listing positions in different orders compare equal
+def spawned_lists(imp, state):
+  return sorted(imp.to_list(imp.spawn_manual(state, n, loc))
+                for loc in imp.empty_tiles(state) for n in (2, 4))
+
+"""
+Returns the names of the checks imp fails on the list board rows, compared
+with reference
+"""
+def check(imp, reference, rows, rng):
+  failures = []
+  expect = lambda name, ok: ok or failures.append(name)
+  state, ref = imp.from_list(rows), reference.from_list(rows)
+
+  expect("to_list", imp.to_list(state) == rows)
+  expect("equal", imp.equal(state, imp.from_list(rows)))
+  moves = imp.move_all(state)
+  for dir, (res, score_inc), (ref_res, ref_inc) in \
+      zip(imp.directions, moves, reference.move_all(ref)):
+    img, inc = imp.move(state, dir)
+    expect(f"move_{dir}", imp.to_list(img) == reference.to_list(ref_res) and
+                          inc == ref_inc)
+    expect(f"move_all_{dir}", imp.equal(res, img) and score_inc == inc)
+    expect(f"equal_{dir}", imp.equal(img, state) ==
+                           (reference.to_list(ref_res) == rows))
+  expect("game_over", imp.game_over(state) == reference.game_over(ref))
+  expect("max_tile", imp.max_tile(state) == reference.max_tile(ref))
+  expect("string_of_board",
+         imp.string_of_board(state) == reference.string_of_board(ref))
+  expect("empty_tiles",
+         len(imp.empty_tiles(state)) == len(reference.empty_tiles(ref)))
+  expect("spawn_manual",
+         spawned_lists(imp, state) == spawned_lists(reference, ref))
+
+  if imp.empty_tiles(state):
+    # spawn_tile draws from the random module, so seed it from rng
+    random.seed(rng.random())
+    spawned = imp.to_list(imp.spawn_tile(state))
+    changed = [(x, y) for x in range(4) for y in range(4)
+               if spawned[x][y] != rows[x][y]]
+    expect("spawn_tile", len(changed) == 1 and
+                         rows[changed[0][0]][changed[0][1]] == 0 and
+                         spawned[changed[0][0]][changed[0][1]] in (2, 4))
+  return failures
+
+"""
+Checks the named implementations (all of them if None) against board on count
+random boards, printing the checks each one fails. Returns whether they all
+passed
+"""
+def conformance(count, seed = 0, names = None, reference = "board"):
+  ref = get(reference)
+  ref.init()
+  passed = True
+  for name in names or registry:
+    imp = get(name)
+    imp.init()
+    rng = random.Random(seed)
+    failures = {}
+    for _ in range(count):
+      rows = random_list(rng)
+      for failure in check(imp, ref, rows, rng):
+        failures.setdefault(failure, rows)
+    if failures:
+      passed = False
+      print(f"{name}: failed {len(failures)} checks")
+      for failure, rows in sorted(failures.items()):
+        print(f"  {failure}, first on {rows}")
+    else:
+      print(f"{name}: passed every check on {count} boards")
+  return passed
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "List the board implementations or check that they agree")
+  parser.add_argument("--conformance", type = int, metavar = "N",
+                      default = None,
+                      help = "check the implementations against board on N "
+                             "random boards")
+  parser.add_argument("--engine", choices = list(registry), action = "append",
+                      default = None,
+                      help = "implementation to check, repeatable (default: "
+                             "all of them)")
+  parser.add_argument("--seed", type = int, default = 0)
+  args = parser.parse_args()
+
+  if args.conformance is None:
+    for name, imp in registry.items():
+      print(f"{name}: {', '.join(modes(imp))}")
+    sys.exit()
+  sys.exit(0 if conformance(args.conformance, args.seed, args.engine) else 1)
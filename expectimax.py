@@ -1,18 +1,117 @@
-import board, heuristics, operator, getch, os, bitboard, time, sys
+import board, heuristics, operator, getch, os, bitboard, time, sys, random, \
+       deepening, npboard
 from collections import Counter
 
+# running count of the nodes searched, read by callers that report throughput
+nodes = 0
+
+# the smallest odds of a single spawn: a 4 on one of at most 15 empty tiles,
+# since a board that has just moved holds at least one tile
+min_spawn_odds = 0.1 / 15
+
+# adds up values one at a time from the left, as fastboard and star do. sum()
+# does the same with floats up to Python 3.11, but compensates for rounding
+# from 3.12, which would make values differ in the last bits
+def total(values):
+  res = 0
+  for value in values:
+    res += value
+  return res
+
+"""
+Returns the expected values of the spawns on the given empties of the bitboard
+res times their odds, in the order expectimax adds them up, when the spawned
+boards are all leaves. The values are the same as searching each spawned board
+to depth 0, but they're scored from the lines of res with
+bitboard.spawn_heuristic rather than from scratch
+"""
+def leaf_evs(res, empties, stats = None):
+  global nodes
+  nodes += 2 * len(empties)
+  deepening.check()
+  lines, values = bitboard.heuristic_lines(res)
+  # a spawn can only end the game by filling the last empty tile
+  last = len(empties) == 1
+  evs = []
+  for empty_tile in empties:
+    # 0.9 - odds of a 2, which has a log value of 1
+    # 0.1 - odds of a 4, which has a log value of 2
+    for tile, odds in ((1, 0.9), (2, 0.1)):
+      if stats is not None:
+        stats.enter(0)
+      if last and bitboard.game_over(res | (tile << (empty_tile << 2))):
+        value = 0
+      elif stats is None:
+        value = bitboard.spawn_heuristic(lines, values, empty_tile, tile)
+      else:
+        value = stats.time("heuristic", bitboard.spawn_heuristic, lines,
+                           values, empty_tile, tile)
+      evs.append(odds/len(empties) * value)
+  return evs
+
+"""
+leaf_evs for npboard: the spawned boards are scored together with one
+npboard.heuristic_stack call
+"""
+def stack_leaf_evs(res, empties, stats = None):
+  global nodes
+  nodes += 2 * len(empties)
+  deepening.check()
+  spawned = npboard.spawn_stack(res, empties)
+  if stats is None:
+    values = npboard.heuristic_stack(spawned).tolist()
+  else:
+    for _ in range(len(spawned)):
+      stats.enter(0)
+    values = stats.time("heuristic", npboard.heuristic_stack, spawned).tolist()
+  if len(empties) == 1:
+    values = [0 if npboard.game_over(s) else v
+              for s, v in zip(spawned, values)]
+  # 0.9 - odds of a 2, 0.1 - odds of a 4
+  return [odds/len(empties) * v
+          for v, odds in zip(values, (0.9, 0.1) * len(empties))]
+
 """
 Give the expected value of state, running the algorithm down to the given
 depth. Also return the move direction that produces the best value
 """
-# imp is the implementation to run with – bitboard or board
-def expectimax(state, depth, imp):
+# imp is the implementation to run with – bitboard, npboard or board
+# table is an optional transposition.TranspositionTable (bitboard only) that
+# values of searched states are read from and written to. Only exact values
+# are written, not ones that cutoff may have cut short or max_spawns sampled
+# prob is the probability of reaching state from the root. Once it drops below
+# cutoff the state is scored by the heuristic instead of being searched further
+# max_spawns caps the number of empty tiles expanded at each chance node; if
+# there are more, that many are sampled at random and weighted equally
+# order optionally gives the order the directions are tried in at this node
+# stats is an optional stats.SearchStats that the search is recorded in
+def expectimax(state, depth, imp, table = None, prob = 1.0, cutoff = 0.0,
+               max_spawns = None, order = None, stats = None):
+  global nodes
+  nodes += 1
+  deepening.check()
+  if stats is not None:
+    stats.enter(depth)
+
+  if table is not None and depth > 0:
+    key, symmetry = table.key(state)
+    hit = table.lookup(key, depth, symmetry)
+    if stats is not None:
+      if hit is None:
+        stats.miss()
+      else:
+        stats.hit()
+    if hit is not None:
+      return hit
+
   if imp.game_over(state):
     # return 0 - non-game over states are boosted by the loss penalty
     return (0, None)
-  if depth == 0:
+  if depth == 0 or prob < cutoff:
     # return the heuristic value for the given state and no direction
-    return (imp.heuristic_value(state), None)
+    if stats is None:
+      return (imp.heuristic_value(state), None)
+    return (stats.time("heuristic", imp.heuristic_value, state), None)
 
   else:
     # do expected value of all children and multiply by the odds of reaching
@@ -20,8 +119,14 @@ def expectimax(state, depth, imp):
 
     ev = {}
 
-    for dir in ["L", "R", "U", "D"]:
-      res, _ = imp.move(state, dir)
+    if stats is None:
+      children = zip(imp.directions, imp.move_all(state))
+    else:
+      children = zip(imp.directions, stats.time("move", imp.move_all, state))
+    if order is not None:
+      children = sorted(children, key = lambda child: order.index(child[0]))
+
+    for dir, (res, _) in children:
       if imp.equal(res, state):
         # set the reward for making no move at all to be -infinity
         # this is necessary because the heuristics can give a negative
@@ -30,16 +135,41 @@ def expectimax(state, depth, imp):
         continue
       # sub_evs is a list of the expected values of the children times the odds
       # of that node being reached
+      if stats is not None:
+        stats.chance()
       sub_evs = []
       empties = imp.empty_tiles(res)
+      # the odds of each child are those of its tile among all the empties,
+      # but the sampled tiles stand in for the rest in the average
+      prob_2 = prob * 0.9 / len(empties)
+      prob_4 = prob * 0.1 / len(empties)
+      if max_spawns is not None and len(empties) > max_spawns:
+        empties = random.sample(empties, max_spawns)
+      if depth == 1 and imp == bitboard:
+        ev[dir] = total(leaf_evs(res, empties, stats))
+        continue
+      if depth == 1 and imp == npboard:
+        ev[dir] = total(stack_leaf_evs(res, empties, stats))
+        continue
       for empty_tile in empties:
         # 0.1 - odds of a 4
         # 0.9 - odds of a 2
-        sub_evs.append(0.9/len(empties) * expectimax(imp.spawn_manual(res, 2, empty_tile), depth - 1, imp)[0])
-        sub_evs.append(0.1/len(empties) * expectimax(imp.spawn_manual(res, 4, empty_tile), depth - 1, imp)[0])
-      ev[dir] = sum(sub_evs)
+        if stats is None:
+          spawn_2 = imp.spawn_manual(res, 2, empty_tile)
+          spawn_4 = imp.spawn_manual(res, 4, empty_tile)
+        else:
+          spawn_2 = stats.time("spawn", imp.spawn_manual, res, 2, empty_tile)
+          spawn_4 = stats.time("spawn", imp.spawn_manual, res, 4, empty_tile)
+        sub_evs.append(0.9/len(empties) * expectimax(spawn_2, depth - 1, imp, table, prob_2, cutoff, max_spawns, None, stats)[0])
+        sub_evs.append(0.1/len(empties) * expectimax(spawn_4, depth - 1, imp, table, prob_4, cutoff, max_spawns, None, stats)[0])
+      ev[dir] = total(sub_evs)
 
     # TODO might be better to calculate state value based on average value of
     # all possible moves, not the value of the best possible move – not sure
     argmax = max(ev.items(), key = operator.itemgetter(1))[0]
+    # with a cutoff, the subtree is exact if even its least likely state
+    # with depth left to search is above it
+    if table is not None and max_spawns is None and \
+       prob * min_spawn_odds ** (depth - 1) >= cutoff:
+      table.store(key, depth, ev[argmax], argmax, symmetry)
     return ev[argmax], argmax
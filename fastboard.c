@@ -0,0 +1,285 @@
+/*
+ * Compiled bitboard primitives and expectimax search, loaded by fastboard.py.
+ *
+ * Works on the same tables as bitboard.py, which are handed over by
+ * fb_set_tables, and makes the same float operations in the same order as
+ * bitboard.heuristic_value and expectimax.expectimax, so results are bit for
+ * bit the same. Built without contracting multiplies and adds so that stays
+ * true on machines with fused multiply-add.
+ */
+#include <stdint.h>
+#include <math.h>
+#include <time.h>
+
+static const uint16_t *move_left_table;
+static const uint16_t *move_right_table;
+static const uint32_t *score_table;
+static const uint64_t *col_up_table;
+static const uint64_t *col_down_table;
+static const double *heuristic_table;
+static const double *col_heuristic_table;
+
+void fb_set_tables(const uint16_t *left, const uint16_t *right,
+                   const uint32_t *scores, const uint64_t *up,
+                   const uint64_t *down, const double *heuristics,
+                   const double *col_heuristics) {
+  move_left_table = left;
+  move_right_table = right;
+  score_table = scores;
+  col_up_table = up;
+  col_down_table = down;
+  heuristic_table = heuristics;
+  col_heuristic_table = col_heuristics;
+}
+
+static uint64_t transpose(uint64_t b) {
+  uint64_t a1 = b & 0xF0F00F0FF0F00F0FULL;
+  uint64_t a2 = b & 0x0000F0F00000F0F0ULL;
+  uint64_t a3 = b & 0x0F0F00000F0F0000ULL;
+  uint64_t a = a1 | (a2 << 12) | (a3 >> 12);
+  uint64_t b1 = a & 0xFF00FF0000FF00FFULL;
+  uint64_t b2 = a & 0x00FF00FF00000000ULL;
+  uint64_t b3 = a & 0x00000000FF00FF00ULL;
+  return b1 | (b2 >> 24) | (b3 << 24);
+}
+
+/* directions are numbered as in bitboard.directions: L, R, U, D */
+void fb_move_all(uint64_t b, uint64_t *boards, uint32_t *scores) {
+  uint64_t t = transpose(b);
+  uint64_t r0 = b & 0xFFFF, r1 = (b >> 16) & 0xFFFF, r2 = (b >> 32) & 0xFFFF,
+           r3 = b >> 48;
+  uint64_t c0 = t & 0xFFFF, c1 = (t >> 16) & 0xFFFF, c2 = (t >> 32) & 0xFFFF,
+           c3 = t >> 48;
+  boards[0] = (uint64_t)move_left_table[r0] |
+              ((uint64_t)move_left_table[r1] << 16) |
+              ((uint64_t)move_left_table[r2] << 32) |
+              ((uint64_t)move_left_table[r3] << 48);
+  boards[1] = (uint64_t)move_right_table[r0] |
+              ((uint64_t)move_right_table[r1] << 16) |
+              ((uint64_t)move_right_table[r2] << 32) |
+              ((uint64_t)move_right_table[r3] << 48);
+  boards[2] = col_up_table[c0] | (col_up_table[c1] << 4) |
+              (col_up_table[c2] << 8) | (col_up_table[c3] << 12);
+  boards[3] = col_down_table[c0] | (col_down_table[c1] << 4) |
+              (col_down_table[c2] << 8) | (col_down_table[c3] << 12);
+  if (scores) {
+    scores[0] = scores[1] = score_table[r0] + score_table[r1] +
+                            score_table[r2] + score_table[r3];
+    scores[2] = scores[3] = score_table[c0] + score_table[c1] +
+                            score_table[c2] + score_table[c3];
+  }
+}
+
+uint64_t fb_move(uint64_t b, int dir, uint32_t *score) {
+  uint64_t boards[4];
+  uint32_t scores[4];
+  fb_move_all(b, boards, scores);
+  *score = scores[dir];
+  return boards[dir];
+}
+
+double fb_heuristic_value(uint64_t b) {
+  uint64_t t = transpose(b);
+  return heuristic_table[b & 0xFFFF] +
+         heuristic_table[(b >> 16) & 0xFFFF] +
+         heuristic_table[(b >> 32) & 0xFFFF] +
+         heuristic_table[b >> 48] +
+         col_heuristic_table[t & 0xFFFF] +
+         col_heuristic_table[(t >> 16) & 0xFFFF] +
+         col_heuristic_table[(t >> 32) & 0xFFFF] +
+         col_heuristic_table[t >> 48];
+}
+
+/* the lowest bit of every empty tile's nibble, as bitboard.empty_mask */
+static uint64_t empty_mask(uint64_t b) {
+  uint64_t x = b | (b >> 1);
+  x |= x >> 2;
+  return ~x & 0x1111111111111111ULL;
+}
+
+int fb_count_empty(uint64_t b) {
+  return __builtin_popcountll(empty_mask(b));
+}
+
+int fb_game_over(uint64_t b) {
+  uint64_t boards[4];
+  if (empty_mask(b)) return 0;
+  fb_move_all(b, boards, 0);
+  for (int dir = 0; dir < 4; dir++)
+    if (boards[dir] != b) return 0;
+  return 1;
+}
+
+/*
+ * Transposition tables are transposition.TranspositionTable's own arrays, and
+ * are probed and filled exactly as it does, so a search leaves the table in
+ * the same state as the Python search would
+ */
+typedef struct {
+  uint64_t *keys;
+  int8_t *depths;
+  double *values;
+  int8_t *moves;
+  uint64_t mask;
+  int shift;
+  int probes;
+  int always;
+  uint64_t hits, misses, collisions, stores, replacements;
+} table_t;
+
+static uint64_t home(const table_t *t, uint64_t b) {
+  return (b * 0x9E3779B97F4A7C15ULL) >> t->shift;
+}
+
+static int lookup(table_t *t, uint64_t b, int depth, double *value,
+                  int *move) {
+  uint64_t slot = home(t, b);
+  for (int i = 0; i < t->probes; i++) {
+    int stored = t->depths[slot];
+    if (stored < 0) break;
+    if (t->keys[slot] == b) {
+      if (stored >= depth) {
+        t->hits++;
+        *value = t->values[slot];
+        *move = t->moves[slot];
+        return 1;
+      }
+      break;
+    }
+    t->collisions++;
+    slot = (slot + 1) & t->mask;
+  }
+  t->misses++;
+  return 0;
+}
+
+static void store(table_t *t, uint64_t b, int depth, double value, int move) {
+  uint64_t slot = home(t, b), first = slot;
+  int64_t victim = -1;
+  int i;
+  for (i = 0; i < t->probes; i++) {
+    int stored = t->depths[slot];
+    if (stored < 0 || t->keys[slot] == b) {
+      /* an existing entry for the same board is only ever made deeper */
+      if (stored > depth && !t->always) return;
+      victim = slot;
+      break;
+    }
+    if (victim < 0 || stored < t->depths[victim]) victim = slot;
+    slot = (slot + 1) & t->mask;
+  }
+  if (i == t->probes) {
+    /* every probed slot holds another board */
+    if (t->always) victim = first;
+    else if (t->depths[victim] > depth) return;
+    t->replacements++;
+  }
+  t->keys[victim] = b;
+  t->depths[victim] = depth;
+  t->values[victim] = value;
+  t->moves[victim] = move;
+  t->stores++;
+}
+
+/*
+ * Search state. Once a time budget is set the clock is read every 1024 nodes
+ * or so, and a search that runs out of time unwinds without finishing or
+ * storing anything
+ */
+static uint64_t nodes, next_check;
+static int timed_out;
+static double budget;
+static struct timespec start;
+static table_t *table;
+
+static void check(void) {
+  struct timespec now;
+  if (budget < 0 || nodes < next_check) return;
+  next_check = nodes + 1024;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  if ((now.tv_sec - start.tv_sec) + (now.tv_nsec - start.tv_nsec) * 1e-9 >
+      budget)
+    timed_out = 1;
+}
+
+static const int default_order[4] = {0, 1, 2, 3};
+
+/* expectimax.expectimax on a bitboard without pruning */
+static double search(uint64_t b, int depth, const int *order, int *best) {
+  uint64_t boards[4];
+  double ev[4], value;
+  nodes++;
+  check();
+  *best = -1;
+  if (timed_out) return 0;
+  if (table && depth > 0 && lookup(table, b, depth, &value, best))
+    return value;
+  if (fb_game_over(b)) return 0;
+  if (depth == 0) return fb_heuristic_value(b);
+
+  fb_move_all(b, boards, 0);
+  for (int i = 0; i < 4; i++) {
+    uint64_t res = boards[order[i]], mask;
+    int n;
+    double sum = 0;
+    if (res == b) {
+      ev[i] = -INFINITY;
+      continue;
+    }
+    mask = empty_mask(res);
+    n = __builtin_popcountll(mask);
+    if (depth == 1) {
+      /* as expectimax.leaf_evs */
+      nodes += 2 * n;
+      for (int pos = 0; pos < 16; pos++) {
+        uint64_t spawn_2, spawn_4;
+        if (!(mask >> (pos << 2) & 1)) continue;
+        spawn_2 = res | (1ULL << (pos << 2));
+        spawn_4 = res | (2ULL << (pos << 2));
+        sum += 0.9 / n * (n == 1 && fb_game_over(spawn_2) ?
+                          0 : fb_heuristic_value(spawn_2));
+        sum += 0.1 / n * (n == 1 && fb_game_over(spawn_4) ?
+                          0 : fb_heuristic_value(spawn_4));
+      }
+    } else {
+      for (int pos = 0; pos < 16; pos++) {
+        int child;
+        if (!(mask >> (pos << 2) & 1)) continue;
+        sum += 0.9 / n * search(res | (1ULL << (pos << 2)), depth - 1,
+                                default_order, &child);
+        sum += 0.1 / n * search(res | (2ULL << (pos << 2)), depth - 1,
+                                default_order, &child);
+        if (timed_out) return 0;
+      }
+    }
+    ev[i] = sum;
+  }
+
+  /* the first of equal values wins, as with max() */
+  int argmax = 0;
+  for (int i = 1; i < 4; i++)
+    if (ev[i] > ev[argmax]) argmax = i;
+  *best = order[argmax];
+  if (table) store(table, b, depth, ev[argmax], *best);
+  return ev[argmax];
+}
+
+/*
+ * Searches b to depth, trying the directions in order (NULL for the usual
+ * order), reading and writing t (NULL for none) and giving up after seconds
+ * have passed (negative for no limit). Writes the value, the best direction
+ * (-1 if there is none) and the nodes searched, and returns 1 if the search
+ * ran out of time and 0 otherwise
+ */
+int fb_expectimax(uint64_t b, int depth, const int *order, table_t *t,
+                  double seconds, double *value, int *move,
+                  uint64_t *searched) {
+  nodes = next_check = 0;
+  timed_out = 0;
+  budget = seconds;
+  table = t;
+  clock_gettime(CLOCK_MONOTONIC, &start);
+  *value = search(b, depth, order ? order : default_order, move);
+  *searched = nodes;
+  return timed_out;
+}
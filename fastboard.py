@@ -0,0 +1,268 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import ctypes, subprocess, hashlib, os, sys, time, random, argparse, \
+       contextlib, io, numpy, bitboard, expectimax, deepening, transposition
+
+"""
+Compiled bitboard search
+
+fastboard.c does what bitboard's move, move_all, heuristic_value, count_empty
+and game_over do, along with a whole expectimax search, in C. It's compiled
+with the system C compiler the first time this module is imported, into the
+table cache directory next to the tables it reads, and loaded with ctypes.
+There is no build step and nothing to install, and without a compiler (or
+with FASTBOARD=0 in the environment) every function here falls back to the
+Python implementation.
+
+The C code reads bitboard's own tables, so bitboard must be initialized
+first, and it gives the same results as the Python code bit for bit, which
+--parity checks. That includes transposition tables, which the C search reads
+and writes in place just as the Python one does. client.expectimax_search and
+parallel's workers hand plain bitboard searches to search here, which is the
+only place the C code pays off: a single call through ctypes costs about as
+much as the Python primitive it replaces.
+"""
+
+# the counters a TranspositionTable keeps, which searches here add to
+table_stats = ("hits", "misses", "collisions", "stores", "replacements")
+
+source = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "fastboard.c")
+
+# the compiled library is named after a hash of its source, so an edited
+# source is rebuilt rather than loaded stale
+def library_path():
+  with open(source, "rb") as f:
+    key = hashlib.sha1(f.read()).hexdigest()[:16]
+  return os.path.join(bitboard.table_cache_dir, f"fastboard-{key}.so")
+
+def build(path):
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+  tmp = f"{path}.{os.getpid()}.tmp"
+  subprocess.run([os.environ.get("CC", "cc"), "-O2", "-shared", "-fPIC",
+                  "-ffp-contract=off", "-o", tmp, source],
+                 check = True, capture_output = True)
+  os.replace(tmp, path)
+
+# fastboard.c's view of a transposition.TranspositionTable, which it reads and
+# writes in place
+class Table(ctypes.Structure):
+  _fields_ = [("keys", ctypes.c_void_p), ("depths", ctypes.c_void_p),
+              ("values", ctypes.c_void_p), ("moves", ctypes.c_void_p),
+              ("mask", ctypes.c_uint64), ("shift", ctypes.c_int),
+              ("probes", ctypes.c_int), ("always", ctypes.c_int)] + \
+             [(name, ctypes.c_uint64) for name in table_stats]
+
+"""
+Returns the loaded library, building it if need be, or None if it can't be
+built or loaded
+"""
+def load():
+  if os.environ.get("FASTBOARD") == "0":
+    return None
+  try:
+    path = library_path()
+    if not os.path.exists(path):
+      build(path)
+    lib = ctypes.CDLL(path)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  u64, u32, i32 = ctypes.c_uint64, ctypes.c_uint32, ctypes.c_int
+  lib.fb_set_tables.argtypes = [ctypes.c_void_p] * 7
+  lib.fb_set_tables.restype = None
+  lib.fb_move.argtypes = [u64, i32, ctypes.POINTER(u32)]
+  lib.fb_move.restype = u64
+  lib.fb_move_all.argtypes = [u64, ctypes.POINTER(u64), ctypes.POINTER(u32)]
+  lib.fb_move_all.restype = None
+  lib.fb_heuristic_value.argtypes = [u64]
+  lib.fb_heuristic_value.restype = ctypes.c_double
+  lib.fb_count_empty.argtypes = [u64]
+  lib.fb_count_empty.restype = i32
+  lib.fb_game_over.argtypes = [u64]
+  lib.fb_game_over.restype = i32
+  lib.fb_expectimax.argtypes = [u64, i32, ctypes.POINTER(i32),
+                                ctypes.POINTER(Table), ctypes.c_double,
+                                ctypes.POINTER(ctypes.c_double),
+                                ctypes.POINTER(i32), ctypes.POINTER(u64)]
+  lib.fb_expectimax.restype = i32
+  return lib
+
+lib = load()
+available = lib is not None
+
+# the bitboard tables the library was last given, kept alive while it uses them
+synced = None
+
+def sync():
+  global synced
+  tables = (bitboard.move_left_table, bitboard.move_right_table,
+            bitboard.score_table, bitboard.col_up_table,
+            bitboard.col_down_table, bitboard.heuristic_table,
+            bitboard.col_heuristic_table)
+  if synced is not None and all(a is b for a, b in zip(tables, synced)):
+    return
+  if any(len(table) != 0x10000 for table in tables):
+    raise RuntimeError("bitboard's tables aren't initialized")
+  # tables loaded from the cache are read-only views, which numpy can still
+  # give the address of
+  lib.fb_set_tables(*(numpy.frombuffer(table, dtype = numpy.uint8).ctypes.data
+                      for table in tables))
+  synced = tables
+
+"""
+The bitboard primitives, compiled when available
+"""
+def move(board, dir):
+  if not available:
+    return bitboard.move(board, dir)
+  if dir not in bitboard.directions:
+    raise bitboard.InvalidMoveDirection(dir)
+  sync()
+  score = ctypes.c_uint32()
+  res = lib.fb_move(board, bitboard.directions.index(dir), ctypes.byref(score))
+  return res, score.value
+
+def move_all(board):
+  if not available:
+    return bitboard.move_all(board)
+  sync()
+  boards = (ctypes.c_uint64 * 4)()
+  scores = (ctypes.c_uint32 * 4)()
+  lib.fb_move_all(board, boards, scores)
+  return tuple(zip(boards, scores))
+
+def heuristic_value(board):
+  if not available:
+    return bitboard.heuristic_value(board)
+  sync()
+  return lib.fb_heuristic_value(board)
+
+def count_empty(board):
+  if not available:
+    return bitboard.count_empty(board)
+  return lib.fb_count_empty(board)
+
+def game_over(board):
+  if not available:
+    return bitboard.game_over(board)
+  sync()
+  return bool(lib.fb_game_over(board))
+
+"""
+Returns expectimax.expectimax(board, depth, bitboard, table, order = order),
+without pruning. table is a transposition.TranspositionTable, which can't be
+symmetric, or None. Searches count towards expectimax.nodes and stop at the
+deadline set by deepening, raising deepening.SearchTimeout, like the Python
+search
+"""
+def search(board, depth, table = None, order = None):
+  if not available or (table is not None and table.symmetric):
+    return expectimax.expectimax(board, depth, bitboard, table, order = order)
+  sync()
+  order_arg = None if order is None else \
+              (ctypes.c_int * 4)(*map(bitboard.directions.index, order))
+  table_arg = None
+  if table is not None:
+    # the arrays are looked up on every search, since clear() replaces one
+    table_arg = Table(
+      *(array.buffer_info()[0] for array in (table.keys, table.depths,
+                                             table.values, table.moves)),
+      table.mask, table.shift, table.probes, table.policy == "always")
+  seconds = -1.0 if deepening.deadline is None else \
+            max(deepening.deadline - time.monotonic(), 0.0)
+  value = ctypes.c_double()
+  dir = ctypes.c_int()
+  nodes = ctypes.c_uint64()
+  timed_out = lib.fb_expectimax(board, depth, order_arg,
+                                None if table_arg is None else
+                                ctypes.byref(table_arg),
+                                seconds, ctypes.byref(value),
+                                ctypes.byref(dir), ctypes.byref(nodes))
+  expectimax.nodes += nodes.value
+  if table_arg is not None:
+    for name in table_stats:
+      setattr(table, name, getattr(table, name) + getattr(table_arg, name))
+  if timed_out:
+    raise deepening.SearchTimeout()
+  if dir.value < 0:
+    return (value.value, None)
+  return (value.value, bitboard.directions[dir.value])
+
+"""
+Checks the compiled functions against bitboard's on count random boards, and
+the search against expectimax.expectimax on searches of them at each of
+depths, with and without a transposition table. Prints each mismatch and
+returns whether they all matched
+"""
+def parity(count, seed = 0, depths = (1, 2, 3), searches = 20):
+  rng = random.Random(seed)
+  boards = []
+  for _ in range(count):
+    # mostly boards with empty tiles, and some full ones for game_over
+    full = rng.random() < 0.1
+    boards.append(sum(rng.randint(0 if not full else 1, 11) << (4 * n)
+                      for n in range(16)
+                      if full or rng.random() < 0.6))
+  mismatches = 0
+  def expect(name, board, got, want):
+    nonlocal mismatches
+    if got != want:
+      mismatches += 1
+      print(f"{name} of {board:#018x}: got {got}, expected {want}")
+
+  for board in boards:
+    for dir in bitboard.directions:
+      expect(f"move_{dir}", board, move(board, dir), bitboard.move(board, dir))
+    expect("move_all", board, move_all(board), bitboard.move_all(board))
+    expect("heuristic_value", board, heuristic_value(board),
+           bitboard.heuristic_value(board))
+    expect("count_empty", board, count_empty(board),
+           bitboard.count_empty(board))
+    expect("game_over", board, game_over(board), bitboard.game_over(board))
+
+  # searches share a table the way a game's searches do, so lookups hit
+  # entries from earlier searches at other depths
+  tables = (transposition.TranspositionTable(size_log2 = 12),
+            transposition.TranspositionTable(size_log2 = 12))
+  for board in boards[:searches]:
+    for depth in depths:
+      nodes = expectimax.nodes
+      want = expectimax.expectimax(board, depth, bitboard)
+      want_nodes, nodes = expectimax.nodes - nodes, expectimax.nodes
+      got = search(board, depth)
+      expect(f"expectimax depth {depth}", board,
+             (got, expectimax.nodes - nodes), (want, want_nodes))
+
+      want = expectimax.expectimax(board, depth, bitboard, tables[0])
+      got = search(board, depth, tables[1])
+      expect(f"expectimax depth {depth} with a table", board, got, want)
+  for name in ("keys", "depths", "values", "moves") + table_stats:
+    if getattr(tables[0], name) != getattr(tables[1], name):
+      mismatches += 1
+      print(f"transposition table {name} differ")
+  return mismatches == 0
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Build the compiled bitboard search and check it")
+  parser.add_argument("--parity", type = int, metavar = "N", default = 1000,
+                      help = "random boards to check the compiled functions "
+                             "on")
+  parser.add_argument("--searches", type = int, default = 20,
+                      help = "of those boards, the number to search at each "
+                             "depth")
+  parser.add_argument("--depth", type = int, default = 3,
+                      help = "deepest search to check")
+  parser.add_argument("--seed", type = int, default = 0)
+  args = parser.parse_args()
+
+  if not available:
+    print("The compiled search couldn't be built or loaded, so the Python "
+          "implementation is in use")
+    sys.exit(1)
+  print("Loaded", library_path())
+  with contextlib.redirect_stdout(io.StringIO()):
+    bitboard.init()
+  passed = parity(args.parity, args.seed, range(1, args.depth + 1),
+                  args.searches)
+  print("Compiled functions match bitboard" if passed else "Mismatches found")
+  sys.exit(0 if passed else 1)
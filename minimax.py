@@ -1,7 +1,233 @@
-import board, getch, os, math, copy, numpy, heuristics, bitboard
+import board, getch, os, math, copy, numpy, heuristics, bitboard, deepening
 
-def maximize(state, d, alpha, beta, imp):
+"""
+Minimax with alpha-beta pruning
+
+maximize and minimize are the entry points and return the best child along
+with the value. Below them the search only passes values around: bitboard
+states are plain ints and need no copying, and list boards are searched by
+placing each spawned tile on the board and taking it back off afterwards.
+
+Children are ordered so that cutoffs come early: directions by how often they
+have caused a cutoff before (the history heuristic), and spawns by trying the
+one that last caused a cutoff at the same depth first (the killer move).
+
+Every function takes an optional stats.SearchStats that the search is recorded
+in, with min nodes counted as chance nodes and the cached bounds as the cache.
+"""
+
+# running count of the nodes searched, read by callers that report throughput
+nodes = 0
+
+# bounds on the values of bitboard states searched so far. With alpha-beta a
+# value outside the search window is only a bound, but it's a true bound
+# whatever window it was found with, so entries stay valid across searches.
+# They can still decide between equal moves, so client.play_game clears them,
+# along with the move ordering, before each game. Keyed on
+# state * 128 + depth * 2 + (1 at min nodes)
+lower_bounds = {}
+upper_bounds = {}
+cache_limit = 1000000
+# the heuristic table the cached bounds were found with
+cache_heuristics = None
+
+# the number of cutoffs each direction has caused, weighted by depth, and the
+# order that gives as indexes into directions
+history = [0, 0, 0, 0]
+history_order = (0, 1, 2, 3)
+# killers[d] is the (position, value) spawn that last caused a cutoff at depth d
+killers = {}
+
+def clear_cache():
+    lower_bounds.clear()
+    upper_bounds.clear()
+
+# the cached bounds depend on the heuristic, so drop them if it has changed
+def check_cache():
+    global cache_heuristics
+    if cache_heuristics is not bitboard.heuristic_table:
+        clear_cache()
+        cache_heuristics = bitboard.heuristic_table
+
+def reset_ordering():
+    global history_order
+    history[:] = [0, 0, 0, 0]
+    history_order = (0, 1, 2, 3)
+    killers.clear()
+
+def record_cutoff(i, d):
+    global history_order
+    history[i] += d * d
+    if i != history_order[0]:
+        history_order = tuple(sorted(history_order,
+                                     key = history.__getitem__,
+                                     reverse = True))
+
+# stores value for key given the window it was searched with
+def store(key, value, alpha, beta):
+    if len(lower_bounds) + len(upper_bounds) > cache_limit:
+        clear_cache()
+    if value > alpha:
+        lower_bounds[key] = value
+    if value < beta:
+        upper_bounds[key] = value
+
+# the value of a state at the bottom of the search, when it's being recorded
+def leaf_value(state, imp, stats):
+    if imp.game_over(state):
+        return 0
+    return stats.time("heuristic", imp.heuristic_value, state)
+
+"""
+Returns the minimax value of state with the max player to move
+"""
+def max_value(state, d, alpha, beta, imp, hashable, stats = None):
+    global nodes
+    nodes += 1
+    if deepening.deadline is not None:
+        deepening.check()
+    if stats is not None:
+        stats.enter(d)
+
+    if d == 0:
+        if stats is not None:
+            return leaf_value(state, imp, stats)
+        return 0 if imp.game_over(state) else imp.heuristic_value(state)
+
+    if hashable:
+        key = state * 128 + d * 2
+        lower = lower_bounds.get(key)
+        if lower is not None and lower >= beta:
+            if stats is not None:
+                stats.hit()
+            return lower
+        upper = upper_bounds.get(key)
+        if upper is not None and (upper <= alpha or upper == lower):
+            if stats is not None:
+                stats.hit()
+            return upper
+        if stats is not None:
+            stats.miss()
+
+    if stats is None:
+        children = imp.move_all(state)
+    else:
+        children = stats.time("move", imp.move_all, state)
+    maxValue = float("-inf")
+    a = alpha
+    for i in history_order:
+        img = children[i][0]
+        if imp.equal(img, state):
+            continue
+        newValue = min_value(img, d - 1, a, beta, imp, hashable, stats)
+        if newValue > maxValue:
+            maxValue = newValue
+            if maxValue >= beta:
+                record_cutoff(i, d)
+                break
+            if maxValue > a:
+                a = maxValue
+
+    # no move changes the board, so the game is over
+    if maxValue == float("-inf"):
+        maxValue = 0
+
+    if hashable:
+        store(key, maxValue, alpha, beta)
+    return maxValue
+
+"""
+Returns the spawns on state in the order they should be searched, the killer
+for depth d first if it applies
+"""
+def spawns(state, d, imp):
+    res = [(loc, n) for loc in imp.empty_tiles(state) for n in (2, 4)]
+    killer = killers.get(d)
+    if killer is not None and killer in res:
+        res.remove(killer)
+        res.insert(0, killer)
+    return res
+
+"""
+Returns the minimax value of state with the min player (the spawner) to move.
+Only reached after a move that changed the board, so there is always an empty
+tile to spawn on
+"""
+def min_value(state, d, alpha, beta, imp, hashable, stats = None):
+    global nodes
+    nodes += 1
+    if deepening.deadline is not None:
+        deepening.check()
+    if stats is not None:
+        stats.enter(d, chance = True)
+
+    if d == 0:
+        if stats is not None:
+            return leaf_value(state, imp, stats)
+        return 0 if imp.game_over(state) else imp.heuristic_value(state)
+
+    if hashable:
+        key = state * 128 + d * 2 + 1
+        lower = lower_bounds.get(key)
+        if lower is not None and lower >= beta:
+            if stats is not None:
+                stats.hit()
+            return lower
+        upper = upper_bounds.get(key)
+        if upper is not None and (upper <= alpha or upper == lower):
+            if stats is not None:
+                stats.hit()
+            return upper
+        if stats is not None:
+            stats.miss()
+
+    minValue = float("inf")
+    b = beta
+    if stats is None:
+        options = spawns(state, d, imp)
+    else:
+        options = stats.time("spawn", spawns, state, d, imp)
+    for spawn in options:
+        newValue = spawn_value(state, spawn, d - 1, alpha, b, imp, hashable,
+                               stats)
+        if newValue < minValue:
+            minValue = newValue
+            if minValue <= alpha:
+                killers[d] = spawn
+                break
+            if minValue < b:
+                b = minValue
+
+    if hashable:
+        store(key, minValue, alpha, beta)
+    return minValue
+
+"""
+Returns the value of state after the given (position, value) spawn
+"""
+def spawn_value(state, spawn, d, alpha, beta, imp, hashable, stats = None):
+    loc, n = spawn
+    if hashable:
+        # bitboard tiles hold the log of their value, and 2 >> 1 and 4 >> 1
+        # are the logs of 2 and 4
+        return max_value(state | ((n >> 1) << (loc << 2)), d, alpha, beta,
+                         imp, True, stats)
+    # list boards get the tile placed for the search and taken off after
+    x, y = loc
+    state[x][y] = n
+    try:
+        return max_value(state, d, alpha, beta, imp, False, stats)
+    finally:
+        state[x][y] = 0
+
+# order optionally gives the order the directions are tried in at this node
+def maximize(state, d, alpha, beta, imp, order = None, stats = None):
     # print("max at depth " + str(d))
+    global nodes
+    nodes += 1
+    deepening.check()
+    if stats is not None:
+        stats.enter(d)
     bestChild = None
     maxValue = float("-inf")
     minbest = None
@@ -10,15 +236,24 @@ def maximize(state, d, alpha, beta, imp):
         return (None, 0, None)
 
     if d == 0:
+        if stats is not None:
+            return (None, stats.time("heuristic", imp.heuristic_value, state),
+                    None)
         return (None, imp.heuristic_value(state), None)
 
     d = d - 1
 
-    for x in ['L', 'R', 'U', 'D']:
-        newboard = copy.deepcopy(state)
-        img,_ = imp.move(newboard, x)
-        if not imp.equal(img, newboard):
-            (minMove, newValue) = minimize(img, d, alpha, beta, imp)
+    if stats is None:
+        children = dict(zip(imp.directions, imp.move_all(state)))
+    else:
+        children = dict(zip(imp.directions,
+                            stats.time("move", imp.move_all, state)))
+    if order is None:
+        order = [imp.directions[i] for i in history_order]
+    for x in order:
+        img = children[x][0]
+        if not imp.equal(img, state):
+            (minMove, newValue) = minimize(img, d, alpha, beta, imp, stats)
             if newValue > maxValue:
                 maxValue = newValue
                 bestChild = x
@@ -30,34 +265,45 @@ def maximize(state, d, alpha, beta, imp):
 
     return (bestChild, maxValue, minbest)
 
-def minimize(state, d, alpha, beta, imp):
+def minimize(state, d, alpha, beta, imp, stats = None):
     # print("min at depth " + str(d))
+    global nodes
+    nodes += 1
+    deepening.check()
+    if stats is not None:
+        stats.enter(d, chance = True)
     bestChild = None
     minValue = float("inf")
-    bestNum = 0
     if imp.game_over(state):
         return (None, 0)
 
     if d == 0:
+        if stats is not None:
+            return (None, stats.time("heuristic", imp.heuristic_value, state))
         return (None, imp.heuristic_value(state))
 
     d = d - 1
 
-    empty_tiles = imp.empty_tiles(state)
-    for loc in empty_tiles:
-        for i in range(1,3):
-            newboard = copy.deepcopy(state)
-            if i == 1:
-                newboard = imp.spawn_manual(newboard, 2, loc)
-            else:
-                newboard = imp.spawn_manual(newboard, 4, loc)
-            (_, newValue, _) = maximize(newboard, d, alpha, beta, imp)
-            if newValue < minValue:
-                minValue = newValue
-                bestChild = (loc, (i * 2))
-            if minValue <= alpha:
-                break
-            if minValue < beta:
-                beta = minValue
+    hashable = imp == bitboard
+    if hashable:
+        check_cache()
+    else:
+        # spawns are searched in place, so leave the caller's board alone
+        state = copy.deepcopy(state)
+
+    if stats is None:
+        options = spawns(state, d + 1, imp)
+    else:
+        options = stats.time("spawn", spawns, state, d + 1, imp)
+    for spawn in options:
+        newValue = spawn_value(state, spawn, d, alpha, beta, imp, hashable,
+                               stats)
+        if newValue < minValue:
+            minValue = newValue
+            bestChild = spawn
+        if minValue <= alpha:
+            break
+        if minValue < beta:
+            beta = minValue
 
     return (bestChild, minValue)
@@ -0,0 +1,61 @@
+import random, operator
+
+"""
+Monte-Carlo rollouts
+
+Each legal move from the root is scored by the mean score gained over a number
+of playouts that start with that move and continue with random moves until
+the game ends or horizon moves have been made.
+"""
+
+# running counts of the playouts and playout moves made, read by callers that
+# report throughput
+playouts = 0
+playout_moves = 0
+
+"""
+Plays from state until the game ends or horizon moves have been made (None for
+no limit) and returns the score gained. Moves are random unless guided is
+set, in which case the move that merges the most is made, breaking ties at
+random
+"""
+def playout(state, imp, horizon = None, guided = False):
+  global playout_moves
+  score = 0
+  made = 0
+  while horizon is None or made < horizon:
+    options = [res for res in imp.move_all(state) if not imp.equal(res[0], state)]
+    if not options:
+      # no legal moves, so the game is over
+      break
+    if guided:
+      best = max(options, key = operator.itemgetter(1))[1]
+      options = [res for res in options if res[1] == best]
+    res, score_inc = random.choice(options)
+    state = imp.spawn_tile(res)
+    score += score_inc
+    made += 1
+  playout_moves += made
+  return score
+
+"""
+Returns the best mean outcome over count playouts per legal move from state,
+along with the move that produces it
+"""
+# imp is the implementation to run with – bitboard or board
+def montecarlo(state, imp, count = 100, horizon = None, guided = False):
+  global playouts
+  ev = {}
+  for dir, (res, score_inc) in zip(imp.directions, imp.move_all(state)):
+    if imp.equal(res, state):
+      continue
+    total = 0
+    for _ in range(count):
+      total += score_inc + playout(imp.spawn_tile(res), imp, horizon, guided)
+    playouts += count
+    ev[dir] = total / count
+
+  if not ev:
+    return (0, None)
+  argmax = max(ev.items(), key = operator.itemgetter(1))[0]
+  return ev[argmax], argmax
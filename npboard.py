@@ -0,0 +1,264 @@
+import random, math, numpy, board, bitboard
+
+"""
+Custom exceptions
+"""
+class FullBoard(Exception):
+  pass
+
+class InvalidMoveDirection(Exception):
+  pass
+
+class InvalidSpawnLocation(Exception):
+  pass
+
+"""
+NumPy boards
+
+Boards are 4x4 numpy.int8 arrays holding the log of each tile (0 for empty),
+indexed [row][column] like the lists of board, and positions are (row, column)
+tuples. Moves go through bitboard's row tables, so init() loads those.
+
+heuristic_value gives exactly the same value as board.heuristic_value, and
+heuristic_stack gives it for a whole N x 4 x 4 stack of boards at once. Every
+term that board computes with math.log on a tile is read from a table indexed
+by rank, built with the same calls, and float terms are added up in the same
+order as board adds them, so nothing is lost to rounding differences.
+
+Evaluating one board costs about as much as evaluating hundreds, so expectimax
+scores all the leaves below a chance node with a single heuristic_stack call.
+minimax searches list boards by writing tile values into them in place, so
+this implementation is for the other modes and for heuristic research.
+"""
+
+# the modes this implementation plays, see engines
+modes = ("expectimax", "montecarlo", "random", "manual")
+
+heuristic_weights = board.heuristic_weights
+
+# numpy tables for moving rows, widened so results can be shifted into place
+move_left_table = move_right_table = score_table = None
+
+# the shift of each tile of a row within a bitboard row, leftmost first
+tile_shifts = numpy.array([12, 8, 4, 0])
+
+def init(weights = board.heuristic_weights):
+  global heuristic_weights, move_left_table, move_right_table, score_table
+  heuristic_weights = weights
+  bitboard.init_moves()
+  move_left_table = numpy.frombuffer(bitboard.move_left_table,
+                                     dtype = numpy.uint16).astype(numpy.int64)
+  move_right_table = numpy.frombuffer(bitboard.move_right_table,
+                                      dtype = numpy.uint16).astype(numpy.int64)
+  score_table = numpy.frombuffer(bitboard.score_table,
+                                 dtype = numpy.uint32).astype(numpy.int64)
+
+def new_board():
+  return numpy.zeros((4, 4), dtype = numpy.int8)
+
+"""
+Converts between these boards and the lists of tile values used by board
+"""
+def from_list(rows):
+  return numpy.array([[0 if n == 0 else int(math.log2(n)) for n in row]
+                      for row in rows], dtype = numpy.int8)
+
+def to_list(state):
+  return [[0 if r == 0 else 2 ** r for r in row] for row in state.tolist()]
+
+def from_bitboard(b):
+  return from_list(bitboard.to_list(b))
+
+def to_bitboard(state):
+  res = 0
+  for row in pack(state).tolist():
+    res = (res << 16) | row
+  return res
+
+def empty_tiles(state):
+  return [(int(x), int(y)) for x, y in zip(*numpy.nonzero(state == 0))]
+
+def equal(b1, b2):
+  return numpy.array_equal(b1, b2)
+
+"""
+Spawns a tile in a empty space of the board. 90% chance of 2, 10% chance of 4
+"""
+def spawn_tile(state):
+  try:
+    loc = random.choice(empty_tiles(state))
+  except IndexError:
+    raise FullBoard("Can't spawn tiles on a full board")
+  return spawn_manual(state, 4 if random.random() < 0.1 else 2, loc)
+
+"""
+Spawns an n tile at loc, a (row, column) tuple
+"""
+def spawn_manual(state, n, loc):
+  if state[loc] != 0:
+    raise InvalidSpawnLocation("Can't spawn a tile where one already exists")
+  res = state.copy()
+  res[loc] = int(math.log2(n))
+  return res
+
+"""
+Returns a stack of state with each of the given empty tiles spawned as a 2 and
+then as a 4, in the order expectimax searches them
+"""
+def spawn_stack(state, empties):
+  xs, ys = numpy.array(empties).T
+  n = numpy.arange(len(empties))
+  res = numpy.repeat(state[None], 2 * len(empties), axis = 0)
+  res[2 * n, xs, ys] = 1
+  res[2 * n + 1, xs, ys] = 2
+  return res
+
+"""
+Moving
+"""
+# packs the last axis of an array of 4 logs, or 4 rows, into bitboard form
+def pack(rows):
+  return (rows.astype(numpy.int64) << tile_shifts).sum(axis = -1)
+
+def unpack(rows):
+  return ((rows[..., None] >> tile_shifts) & 0xF).astype(numpy.int8)
+
+def move_rows(rows, table):
+  packed = pack(rows)
+  return unpack(table[packed]), int(score_table[packed].sum())
+
+"""
+Returns the result of moving state in the given direction (L, R, U, D) and
+the increase in score from making that move as tuple (new_state, score_inc)
+"""
+def move(state, dir):
+  if dir == "L":
+    return move_rows(state, move_left_table)
+  elif dir == "R":
+    return move_rows(state, move_right_table)
+  elif dir == "U":
+    res, score_inc = move_rows(state.T, move_left_table)
+    return res.T.copy(), score_inc
+  elif dir == "D":
+    res, score_inc = move_rows(state.T, move_right_table)
+    return res.T.copy(), score_inc
+  raise InvalidMoveDirection(dir)
+
+directions = ("L", "R", "U", "D")
+
+def move_all(state):
+  return tuple(move(state, dir) for dir in directions)
+
+def game_over(state):
+  if not state.all():
+    return False
+  for dir in directions:
+    if not equal(move(state, dir)[0], state):
+      return False
+  return True
+
+def max_tile(state):
+  r = int(state.max())
+  return 0 if r == 0 else 2 ** r
+
+def string_of_board(state):
+  return board.string_of_board(to_list(state))
+
+"""
+Heuristics
+
+Tables of board's per-tile math, indexed by rank
+"""
+ranks = range(16)
+# board.monotonicity's tile value, math.log(v) / math.log(2)
+log_table = numpy.array([0.0] + [math.log(2 ** r) / math.log(2)
+                                  for r in ranks[1:]])
+# board.smoothness compares each tile with itself, so a tile's penalty is the
+# distance between its two ways of taking the log
+smooth_table = numpy.array([0.0] + [abs(math.log(2 ** r / math.log(2)) -
+                                        math.log(2 ** r) / math.log(2))
+                                    for r in ranks[1:]])
+# math.log of the number of empty tiles
+empty_log_table = numpy.array([0.0] + [math.log(n) for n in range(1, 17)])
+value_table = numpy.array([0] + [2 ** r for r in ranks[1:]],
+                          dtype = numpy.int64)
+
+# the 4 gradients of board.getBoardValue2
+gradients = numpy.array([
+  [[ 3,  2,  1,  0], [ 2,  1,  0, -1], [ 1,  0, -1, -2], [ 0, -1, -2, -3]],
+  [[ 0,  1,  2,  3], [-1,  0,  1,  2], [-2, -1,  0,  1], [-3, -2, -1,  0]],
+  [[ 0, -1, -2, -3], [ 1,  0, -1, -2], [ 2,  1,  0, -1], [ 3,  2,  1,  0]],
+  [[-3, -2, -1,  0], [-2, -1,  0,  1], [-1,  0,  1,  2], [ 0,  1,  2,  3]]],
+  dtype = numpy.int64)
+
+def smoothness_stack(states):
+  penalties = smooth_table[states.reshape(len(states), 16)]
+  smoothness = numpy.zeros(len(states))
+  # subtracted one at a time, twice per tile, as board does
+  for i in range(16):
+    smoothness = smoothness - penalties[:, i]
+    smoothness = smoothness - penalties[:, i]
+  return smoothness
+
+"""
+board.monotonicity's walk along one side: lines[k] is the value of line k at
+each step, and the walk moves from one step to the next nonzero one, over at
+most the first 3 steps. falling is the comparison that counts against it
+"""
+def walk(lines, falling):
+  n = lines.shape[0]
+  total = numpy.zeros(n)
+  current = numpy.zeros(n, dtype = numpy.int64)
+  next = numpy.ones(n, dtype = numpy.int64)
+  rows = numpy.arange(n)
+  for k in range(3):
+    line = lines[:, k]
+    # skip ahead over empty tiles, stopping at the 4th step
+    for _ in range(2):
+      skip = (next < 3) & (line[rows, numpy.minimum(next, 3)] == 0)
+      next = numpy.where(skip, next + 1, next)
+    next = numpy.where(next >= 4, next - 1, next)
+    current_value = log_table[line[rows, current]]
+    next_value = log_table[line[rows, next]]
+    if falling:
+      total = numpy.where(current_value > next_value,
+                          total + (next_value - current_value), total)
+    else:
+      total = numpy.where(next_value > current_value,
+                          total + (current_value - next_value), total)
+    current = next
+    next = next + 1
+  return total
+
+def monotonicity_stack(states):
+  # up and down walk along the rows, taking rows 0, 1, 2 and 2, 1, 0 in turn,
+  # and right and left along the columns
+  rows = states.astype(numpy.int64)
+  cols = rows.transpose(0, 2, 1)
+  up = walk(rows[:, :3], True)
+  down = walk(rows[:, 2::-1], False)
+  right = walk(cols[:, :3], True)
+  left = walk(cols[:, 2::-1], False)
+  # max() keeps the first of two equal values
+  return numpy.where(down > up, down, up) + \
+         numpy.where(left > right, left, right)
+
+def gradient_stack(states):
+  values = value_table[states]
+  return numpy.einsum("gxy,nxy->ng", gradients, values).max(axis = 1)
+
+"""
+Returns board.heuristic_value of every board in an N x 4 x 4 stack
+"""
+def heuristic_stack(states):
+  smooth, empty, mono, max, corner = heuristic_weights
+  empties = (states == 0).reshape(len(states), 16).sum(axis = 1)
+  sum = smoothness_stack(states) * smooth
+  sum = numpy.where(empties != 0, sum + empty_log_table[empties] * empty, sum)
+  sum = sum + monotonicity_stack(states) * mono
+  sum = sum + value_table[states.reshape(len(states), 16).max(axis = 1)] * max
+  sum = sum + gradient_stack(states) * corner
+  return sum
+
+def heuristic_value(state):
+  return float(heuristic_stack(state[None])[0])
@@ -0,0 +1,184 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import asyncio, concurrent.futures, argparse, time, client, engines
+from collections import Counter
+
+"""
+Concurrent game sessions
+
+Plays many games at once on an asyncio event loop. The game itself - spawning,
+moving, scoring and checking for the end - is cheap and runs on the loop with
+client.step, while each search is handed to a process pool with
+client.choose_move so the loop is free to advance other sessions meanwhile.
+
+Searches wait for one of a fixed number of slots before they're submitted, so
+when the pool is saturated sessions queue up on the loop instead of piling
+work onto the pool. A slot is only given back once its search has finished in
+the pool, even if the session stopped waiting for it. A session can be given a
+deadline, after which its pending search is abandoned and the game ends where
+it stands. Cancelling a session's task stops it the same way, marks it
+cancelled in sessions and passes the cancellation on.
+
+Sessions share the random module, so unlike timing.py their games depend on
+how they're scheduled and aren't reproducible from a seed.
+"""
+
+# the transposition tables of a worker process, by (implementation, symmetric),
+# shared by every search the process runs so they stay warm between moves
+tables = {}
+
+def init_worker():
+  for imp in engines.registry.values():
+    imp.init()
+
+# choose_move in a worker process. Modules can't be sent to another process,
+# so the implementation is passed by name
+def choose_move_job(mode, imp_name, state, depth, symmetric, options):
+  imp = engines.get(imp_name)
+  key = (imp_name, symmetric)
+  if key not in tables:
+    tables[key] = client.new_table(imp, symmetric)
+  return client.choose_move(mode, imp, state, depth, tables[key], **options)
+
+# loop.call_soon_threadsafe, unless the loop has already closed, in which case
+# nothing is left to call back
+def call_soon_threadsafe(loop, callback):
+  try:
+    loop.call_soon_threadsafe(callback)
+  except RuntimeError:
+    pass
+
+class Session:
+
+  def __init__(self, number, state):
+    self.number = number
+    self.state = state
+    self.moves = 0
+    self.score = 0
+    self.timed_out = False
+    self.cancelled = False
+    self.seconds = 0.0
+
+class Orchestrator:
+
+  # workers is the number of search processes, and max_pending the number of
+  # searches that may be submitted to them at once (twice workers by default)
+  def __init__(self, workers = 4, max_pending = None):
+    # the games are played in this process, so it needs the tables too
+    init_worker()
+    self.executor = concurrent.futures.ProcessPoolExecutor(
+      max_workers = workers, initializer = init_worker)
+    self.slots = asyncio.Semaphore(max_pending or 2 * workers)
+    self.searches = 0
+    # every Session played, by number, including ones whose task was cancelled
+    self.sessions = {}
+
+  """
+  Returns the search result of choose_move_job, waiting for a free slot
+  before submitting it
+  """
+  async def choose_move(self, mode, imp, state, depth, symmetric, options):
+    loop = asyncio.get_running_loop()
+    await self.slots.acquire()
+    self.searches += 1
+    future = self.executor.submit(choose_move_job, mode, engines.name_of(imp),
+                                  state, depth, symmetric, options)
+    # the callback runs in the pool's thread once the search is done, or at
+    # once if it's cancelled before it starts
+    future.add_done_callback(
+      lambda _: call_soon_threadsafe(loop, self.slots.release))
+    return await asyncio.wrap_future(future)
+
+  """
+  Plays a game until it ends, its deadline of seconds after it starts passes,
+  or its task is cancelled, and returns the Session. options are passed on to
+  client.choose_move
+  """
+  async def play(self, number, mode, imp, depth, deadline = None,
+                 symmetric = False, **options):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    session = self.sessions[number] = Session(number, client.new_game(imp))
+    try:
+      while not imp.game_over(session.state):
+        timeout = None if deadline is None else \
+                  deadline - (loop.time() - start)
+        move, spawn = await asyncio.wait_for(
+          self.choose_move(mode, imp, session.state, depth, symmetric,
+                           options), timeout)
+        res = client.step(imp, session.state, move, spawn)
+        if res is None:
+          continue
+        session.state, score_inc = res
+        session.moves += 1
+        session.score += score_inc
+    except asyncio.TimeoutError:
+      session.timed_out = True
+    except asyncio.CancelledError:
+      session.cancelled = True
+      raise
+    finally:
+      session.seconds = loop.time() - start
+    return session
+
+  """
+  Plays count sessions at once and returns them in order
+  """
+  async def run(self, count, mode, imp, depth, **options):
+    return await asyncio.gather(*(self.play(n, mode, imp, depth, **options)
+                                  for n in range(count)))
+
+  def close(self):
+    self.executor.shutdown(wait = False, cancel_futures = True)
+
+async def main(args):
+  orchestrator = Orchestrator(args.workers, args.max_pending)
+  try:
+    start = time.time()
+    sessions = await orchestrator.run(
+      args.sessions, args.mode, engines.get(args.implementation), args.depth,
+      deadline = args.deadline, ms_per_move = args.ms_per_move)
+    wall_time = time.time() - start
+  finally:
+    orchestrator.close()
+
+  imp = engines.get(args.implementation)
+  for session in sessions:
+    status = " (timed out)" if session.timed_out else \
+             " (cancelled)" if session.cancelled else ""
+    print(f"Session {session.number+1}: {session.moves} moves, score "
+          f"{session.score}, max tile {imp.max_tile(session.state)} in "
+          f"{round(session.seconds, 2)} seconds{status}")
+  moves = sum(session.moves for session in sessions)
+  print("Ran", args.sessions, args.mode, "sessions in", round(wall_time, 2),
+        "seconds over", args.workers, "processes.")
+  print("Searches:", orchestrator.searches, "moves/sec:",
+        round(moves / wall_time, 2))
+  print("Max final tile distribution:")
+  occs = Counter(imp.max_tile(session.state) for session in sessions)
+  for v in sorted(occs.keys(), reverse = True):
+    print("  * ", str(v), ": ", occs[v])
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Play many games at once, searching in a process pool")
+  parser.add_argument("mode", choices = ["minimax_random",
+                                         "minimax_antagonistic", "expectimax",
+                                         "montecarlo", "random"])
+  parser.add_argument("sessions", type = int)
+  parser.add_argument("implementation", choices = list(engines.registry))
+  parser.add_argument("depth", type = int)
+  parser.add_argument("--workers", type = int, default = 4,
+                      help = "search processes")
+  parser.add_argument("--max-pending", type = int, default = None,
+                      help = "searches submitted to the processes at once "
+                             "(default: twice the workers)")
+  parser.add_argument("--deadline", type = float, default = None,
+                      help = "end each session after this many seconds")
+  parser.add_argument("--ms-per-move", type = float, default = None,
+                      help = "deepen searches until this many milliseconds "
+                             "have passed, up to the given depth")
+  args = parser.parse_args()
+  if not engines.supports(engines.get(args.implementation), args.mode):
+    parser.error(f"the {args.implementation} implementation doesn't play "
+                 f"{args.mode} games")
+  asyncio.run(main(args))
@@ -0,0 +1,128 @@
+import concurrent.futures, operator, random, time, bitboard, expectimax, \
+       transposition, deepening, fastboard
+
+"""
+Root-parallel expectimax
+
+The root move and spawn of a bitboard search are expanded here, and the
+chance-node children they produce are searched in a pool of worker processes.
+Each worker loads the bitboard tables once when it starts and keeps its own
+transposition table for as long as it lives, so consecutive searches reuse
+the work of earlier ones.
+"""
+
+pool = None
+pool_workers = None
+pool_weights = None
+
+# the transposition table of the current worker process
+table = None
+
+def init_worker(weights):
+  global table
+  # maps the cached tables written by the parent rather than rebuilding them
+  bitboard.init(weights)
+  table = transposition.TranspositionTable()
+
+"""
+Searches a single child in a worker, returning its value and the number of
+nodes searched. Plain searches run compiled, as they do serially
+"""
+def evaluate(state, depth, prob, cutoff, max_spawns):
+  before = expectimax.nodes
+  if not cutoff and max_spawns is None:
+    value, _ = fastboard.search(state, depth, table)
+  else:
+    value, _ = expectimax.expectimax(state, depth, bitboard, table, prob,
+                                     cutoff, max_spawns)
+  return value, expectimax.nodes - before
+
+"""
+Returns the pool of worker processes, starting one with the given number of
+workers if needed. Workers use the given weights, by default the ones this
+process's heuristic table was built with
+"""
+def get_pool(workers, weights = None):
+  global pool, pool_workers, pool_weights
+  if weights is None:
+    weights = bitboard.heuristic_weights
+  if pool is None or pool_workers != workers or pool_weights != weights:
+    shutdown()
+    pool = concurrent.futures.ProcessPoolExecutor(
+      max_workers = workers, initializer = init_worker, initargs = (weights,))
+    pool_workers = workers
+    pool_weights = weights
+  return pool
+
+def shutdown():
+  global pool, pool_workers, pool_weights
+  if pool is not None:
+    pool.shutdown(cancel_futures = True)
+    pool = pool_workers = pool_weights = None
+
+"""
+Gives the same result as expectimax.expectimax on a bitboard, but searches the
+children of the root's chance nodes in parallel. Returns (value, move, nodes)
+where nodes is the total number of nodes searched across all workers.
+
+Stops with deepening.SearchTimeout if a deadline set by iterative deepening
+passes before every child has been searched.
+"""
+def parallel_expectimax(state, depth, workers, cutoff = 0.0, max_spawns = None,
+                        order = None):
+  if depth == 0 or bitboard.game_over(state):
+    value, move = expectimax.expectimax(state, depth, bitboard)
+    return value, move, 1
+
+  executor = get_pool(workers)
+  # (direction, weight, future) for every child of every root chance node,
+  # in the order the serial search would visit them
+  jobs = []
+  ev = {}
+
+  children = zip(bitboard.directions, bitboard.move_all(state))
+  if order is not None:
+    children = sorted(children, key = lambda child: order.index(child[0]))
+
+  for dir, (res, _) in children:
+    if res == state:
+      ev[dir] = float("-inf")
+      continue
+    ev[dir] = 0
+    empties = bitboard.empty_tiles(res)
+    prob_2 = 0.9 / len(empties)
+    prob_4 = 0.1 / len(empties)
+    if max_spawns is not None and len(empties) > max_spawns:
+      empties = random.sample(empties, max_spawns)
+    for empty_tile in empties:
+      for value, prob, weight in ((2, prob_2, 0.9), (4, prob_4, 0.1)):
+        child = bitboard.spawn_manual(res, value, empty_tile)
+        jobs.append((dir, weight / len(empties),
+                     executor.submit(evaluate, child, depth - 1, prob, cutoff,
+                                     max_spawns)))
+
+  futures = [future for _, _, future in jobs]
+  timeout = None
+  if deepening.deadline is not None:
+    timeout = max(0, deepening.deadline - time.monotonic())
+  _, pending = concurrent.futures.wait(futures, timeout = timeout)
+  if pending:
+    for future in pending:
+      future.cancel()
+    raise deepening.SearchTimeout()
+
+  # sum in the same order as the serial search so the values match exactly
+  nodes = 1 + len(ev)
+  sub_evs = {dir: [] for dir in ev}
+  for dir, weight, future in jobs:
+    value, count = future.result()
+    sub_evs[dir].append(weight * value)
+    nodes += count
+  for dir in sub_evs:
+    if sub_evs[dir]:
+      ev[dir] = expectimax.total(sub_evs[dir])
+
+  # count the workers' nodes as if they had been searched here
+  expectimax.nodes += nodes
+  argmax = max(ev.items(), key = operator.itemgetter(1))[0]
+  return ev[argmax], argmax, nodes
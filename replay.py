@@ -0,0 +1,192 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import struct, mmap, os, sys, argparse, numpy, bitboard, npboard
+
+"""
+Game logs
+
+Games are recorded as a stream of fixed size binary records, one per move:
+
+  board       Q  the bitboard before the move
+  direction   B  index into bitboard.directions
+  spawn       B  position of the tile spawned after the move
+  value       B  log of the spawned tile's value
+  (padding)   x
+  score       I  the increase in score from the move
+
+A game starts with a record holding its first board, with direction, spawn
+and value all set to game_start, so any number of games can follow each other
+in one file. List boards are recorded as the equivalent bitboard.
+
+Recorder buffers records and writes them out in large blocks, and Replay maps
+a log into memory and unpacks records straight from it.
+"""
+
+LOG_VERSION = 1
+LOG_MAGIC = b"2048LOG\0"
+LOG_HEADER = struct.Struct("<8sII")
+record_struct = struct.Struct("<QBBBxI")
+game_start = 0xFF
+
+direction_index = {dir: i for i, dir in enumerate(bitboard.directions)}
+
+"""
+Custom exceptions
+"""
+class InvalidLog(Exception):
+  pass
+
+"""
+Returns the (position, log value) of the tile spawned on before to give after
+"""
+def spawn_of(before, after):
+  spawned = after ^ before
+  pos = (spawned.bit_length() - 1) >> 2
+  return pos, (spawned >> (pos << 2)) & 0xF
+
+# list and npboard boards are recorded as bitboards
+def as_bitboard(state):
+  if isinstance(state, int):
+    return state
+  if isinstance(state, numpy.ndarray):
+    return npboard.to_bitboard(state)
+  return bitboard.from_list(state)
+
+class Recorder:
+
+  # buffer_size is the number of records held before they're written out
+  def __init__(self, path, buffer_size = 4096):
+    exists = os.path.exists(path) and os.path.getsize(path) > 0
+    self.file = open(path, "ab")
+    if not exists:
+      self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION,
+                                      record_struct.size))
+    self.buffer = bytearray(record_struct.size * buffer_size)
+    self.offset = 0
+    self.records = 0
+
+  def write(self, board, direction, spawn, value, score):
+    record_struct.pack_into(self.buffer, self.offset, board, direction, spawn,
+                            value, score)
+    self.offset += record_struct.size
+    self.records += 1
+    if self.offset == len(self.buffer):
+      self.flush()
+
+  def start_game(self, state):
+    self.write(as_bitboard(state), game_start, game_start, game_start, 0)
+
+  """
+  Records a move in direction from state, which gave moved with score_inc
+  and then spawned spawned
+  """
+  def record(self, state, direction, moved, spawned, score_inc):
+    board = as_bitboard(state)
+    spawn, value = spawn_of(as_bitboard(moved), as_bitboard(spawned))
+    self.write(board, direction_index[direction], spawn, value, score_inc)
+
+  def flush(self):
+    self.file.write(memoryview(self.buffer)[:self.offset])
+    self.offset = 0
+
+  def close(self):
+    self.flush()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+class Replay:
+
+  def __init__(self, path):
+    # an empty file can't be mapped
+    if os.path.getsize(path) < LOG_HEADER.size:
+      raise InvalidLog(path)
+    with open(path, "rb") as f:
+      self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    magic, version, size = LOG_HEADER.unpack_from(self.data)
+    if magic != LOG_MAGIC or version != LOG_VERSION or \
+       size != record_struct.size:
+      raise InvalidLog(path)
+    # a partly written last record is left out
+    self.count = (len(self.data) - LOG_HEADER.size) // record_struct.size
+    self.view = memoryview(self.data)[
+      LOG_HEADER.size:LOG_HEADER.size + self.count * record_struct.size]
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, i):
+    if not 0 <= i < self.count:
+      raise IndexError(i)
+    return record_struct.unpack_from(self.view, i * record_struct.size)
+
+  # yields (board, direction, spawn, value, score) tuples, game starts included
+  def __iter__(self):
+    return record_struct.iter_unpack(self.view)
+
+  """
+  Yields each game as its starting board and a list of its move records
+  """
+  def games(self):
+    start, moves = None, []
+    for record in self:
+      if record[1] == game_start:
+        if start is not None:
+          yield start, moves
+        start, moves = record[0], []
+      else:
+        moves.append(record)
+    if start is not None:
+      yield start, moves
+
+  def close(self):
+    self.view.release()
+    self.data.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+"""
+Plays the moves of every game in the log again with bitboard and returns the
+number of records that don't follow from the one before, checking that each
+move gives the recorded score and is followed by the recorded board
+"""
+def verify(log):
+  bitboard.init_moves()
+  mismatches = 0
+  for start, moves in log.games():
+    expected = start
+    for board, direction, spawn, value, score in moves:
+      moved, score_inc = bitboard.move(board, bitboard.directions[direction])
+      if board != expected or score_inc != score:
+        mismatches += 1
+      expected = moved | (value << (spawn << 2))
+  return mismatches
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Summarize a game log")
+  parser.add_argument("log")
+  parser.add_argument("--verify", action = "store_true",
+                      help = "replay every move and check it against the log")
+  args = parser.parse_args()
+
+  with Replay(args.log) as log:
+    games = 0
+    scores = []
+    for start, moves in log.games():
+      games += 1
+      scores.append(sum(record[4] for record in moves))
+    print(f"{games} games, {len(log) - games} moves")
+    if games:
+      print("Average final score:", round(sum(scores) / games, 2))
+    if args.verify:
+      mismatches = verify(log)
+      print("Mismatched records:", mismatches)
+      if mismatches:
+        sys.exit(1)
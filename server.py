@@ -0,0 +1,201 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import sys, json, time, threading, argparse, concurrent.futures, statistics, \
+       contextlib, bitboard, client, minimax, expectimax, montecarlo, \
+       transposition, deepening
+
+"""
+Headless move server
+
+Reads requests from stdin as JSON lines and writes a JSON line response to
+stdout for each. A request gives a board and how to search it:
+
+  {"id": 1, "board": "0x1200000000000011", "mode": "expectimax", "depth": 3}
+
+The board is a bitboard, either as an int or a hex string, or a 4x4 list of
+tile values as used by board. mode is one of expectimax (the default),
+minimax or montecarlo, and depth, ms_per_move, cutoff, max_spawns, playouts
+and horizon are as in timing.py. "boards" may be given instead of "board" to
+have a list of boards searched with the same settings in one request. The
+response holds the id, the chosen move (or a list of them), the value, the
+nodes searched, and the time the search took and the time since the request
+was read, both in milliseconds:
+
+  {"id": 1, "move": "L", "value": 1874.2, "nodes": 4421, "search_ms": 21.4,
+   "latency_ms": 22.0}
+
+Requests that can't be served get {"id": ..., "error": "..."} instead, and
+{"cmd": "stats"} returns the number of requests served and their latencies.
+
+Searches run in a pool of worker processes that load the tables once and keep
+their transposition tables and caches between requests, so responses may come
+back in a different order from the requests. With no workers, requests are
+served in turn by the server process itself.
+"""
+
+modes = ("expectimax", "minimax", "montecarlo")
+
+# the transposition table of this process, kept for as long as it runs
+table = None
+
+def init_worker():
+  global table
+  # stdout carries the responses, so progress messages go to stderr
+  with contextlib.redirect_stdout(sys.stderr):
+    bitboard.init()
+  table = transposition.TranspositionTable()
+
+def parse_board(board):
+  if isinstance(board, str):
+    return int(board, 16)
+  if isinstance(board, list):
+    return bitboard.from_list(board)
+  return board
+
+"""
+Returns the (move, value) chosen for state with the settings of request
+"""
+def search(state, request):
+  mode = request.get("mode", "expectimax")
+  depth = request.get("depth", 3)
+  ms_per_move = request.get("ms_per_move")
+  if mode == "montecarlo":
+    value, move = montecarlo.montecarlo(state, bitboard,
+                                        request.get("playouts", 100),
+                                        request.get("horizon", 20))
+    return move, value
+
+  if mode == "expectimax":
+    cutoff = request.get("cutoff", 0.0)
+    max_spawns = request.get("max_spawns")
+    run = lambda d, order: client.expectimax_search(state, d, bitboard, table,
+                                                    cutoff, max_spawns, order)
+    value_of = lambda result: result[0]
+  else:
+    run = lambda d, order: client.minimax_search(state, d, bitboard, order)
+    value_of = lambda result: result[1]
+
+  if ms_per_move is None:
+    move, result = run(depth, None)
+  else:
+    move, result, _ = deepening.iterative_deepening(run, bitboard.directions,
+                                                    ms_per_move, depth)
+  return move, value_of(result)
+
+"""
+Serves a request in this process and returns the response, less its latency
+"""
+def solve(request):
+  start = time.perf_counter()
+  nodes = expectimax.nodes + minimax.nodes + montecarlo.playout_moves
+  try:
+    if request.get("mode", "expectimax") not in modes:
+      raise ValueError(f"unknown mode {request['mode']}")
+    if "boards" in request:
+      results = [search(parse_board(b), request) for b in request["boards"]]
+      move = [res[0] for res in results]
+      value = [res[1] for res in results]
+    else:
+      move, value = search(parse_board(request["board"]), request)
+  except Exception as e:
+    return {"id": request.get("id"), "error": f"{type(e).__name__}: {e}"}
+  return {
+    "id": request.get("id"),
+    "move": move,
+    "value": value,
+    "nodes": expectimax.nodes + minimax.nodes + montecarlo.playout_moves -
+             nodes,
+    "search_ms": (time.perf_counter() - start) * 1000,
+  }
+
+class Server:
+
+  # workers is the number of worker processes, or 0 to search in this one
+  def __init__(self, workers = 0, out = sys.stdout):
+    self.out = out
+    self.lock = threading.Lock()
+    self.latencies = []
+    self.pending = set()
+    if workers:
+      self.pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers = workers, initializer = init_worker)
+    else:
+      self.pool = None
+      init_worker()
+
+  def respond(self, response):
+    with self.lock:
+      if "latency_ms" in response:
+        self.latencies.append(response["latency_ms"])
+      self.out.write(json.dumps(response) + "\n")
+      self.out.flush()
+
+  def stats(self):
+    with self.lock:
+      latencies = sorted(self.latencies)
+    res = {"requests": len(latencies), "pending": len(self.pending)}
+    if latencies:
+      res["mean_ms"] = statistics.mean(latencies)
+      res["p50_ms"] = latencies[len(latencies) // 2]
+      res["p99_ms"] = latencies[min(len(latencies) - 1,
+                                    len(latencies) * 99 // 100)]
+    return res
+
+  """
+  Handles a line of input, responding straight away when there are no
+  workers and once the search finishes otherwise
+  """
+  def handle(self, line):
+    received = time.perf_counter()
+    try:
+      request = json.loads(line)
+      if not isinstance(request, dict):
+        raise ValueError("requests must be JSON objects")
+    except ValueError as e:
+      self.respond({"id": None, "error": f"invalid request: {e}"})
+      return
+    if request.get("cmd") == "stats":
+      self.respond({"id": request.get("id"), **self.stats()})
+      return
+
+    def finish(response):
+      if "error" not in response:
+        response["latency_ms"] = (time.perf_counter() - received) * 1000
+      self.respond(response)
+
+    if self.pool is None:
+      finish(solve(request))
+      return
+    future = self.pool.submit(solve, request)
+    with self.lock:
+      self.pending.add(future)
+    def done(future):
+      with self.lock:
+        self.pending.discard(future)
+      try:
+        response = future.result()
+      except Exception as e:
+        # the worker died, taking the search with it
+        response = {"id": request.get("id"),
+                    "error": f"{type(e).__name__}: {e}"}
+      finish(response)
+    future.add_done_callback(done)
+
+  def serve(self, lines):
+    for line in lines:
+      if line.strip():
+        self.handle(line)
+    self.close()
+
+  # waits for outstanding searches to be answered
+  def close(self):
+    if self.pool is not None:
+      self.pool.shutdown(wait = True)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Serve moves for boards read from stdin as JSON lines")
+  parser.add_argument("--workers", type = int, default = 0,
+                      help = "search in this many worker processes (default: "
+                             "search in the server process)")
+  args = parser.parse_args()
+  Server(args.workers).serve(sys.stdin)
@@ -0,0 +1,190 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import time, argparse, sys, contextlib, io, numpy, bitboard, deepening, \
+       expectimax, fastboard
+
+"""
+Star1 expectimax
+
+Expectimax over bitboards that skips the rest of a chance node once its value
+can no longer matter. Every searched value lies between bounds taken from the
+heuristic table - the smallest and largest sum of 8 table entries, or 0 for a
+finished game - so after some of a chance node's children have been searched
+its value is at most their weighted sum plus the largest possible value of the
+rest. When that falls to the value the parent max node already has from
+another move, the chance node can't be chosen and is cut off. Each child is
+searched with the bound it would have to beat for the chance node to survive.
+
+Max nodes try moves in order of the heuristic value of the board they lead to,
+so a good value is found first and the moves after it are cut off sooner.
+
+Values that aren't cut off are added up in the same order as expectimax does,
+so the root gets the same value and move as expectimax.expectimax without a
+table. Bounds are loosened by a small margin so that float rounding can't cut
+off a move it shouldn't. Searches only ever have a lower bound to beat, as
+the root has no upper one, so probing children for early cutoffs from above,
+as Star2 does, never has anything to cut against and isn't done.
+"""
+
+# running count of the nodes searched, as in expectimax
+nodes = 0
+
+# (lower, upper, margin) for the heuristic table they were found for
+bounds_cache = (None, None)
+
+"""
+Returns (lower, upper, margin) bounds on any value a search can give with the
+current heuristic table, and the margin cutoffs are loosened by
+"""
+def bounds():
+  global bounds_cache
+  if bounds_cache[0] is not bitboard.heuristic_table:
+    table = numpy.frombuffer(bitboard.heuristic_table, dtype = numpy.float64)
+    # sums of floats no bigger than the largest entry are no bigger than 8
+    # times it, and likewise for the smallest
+    lower = min(8 * float(table.min()), 0.0)
+    upper = max(8 * float(table.max()), 0.0)
+    margin = 1e-6 * max(abs(lower), abs(upper), 1.0)
+    bounds_cache = (bitboard.heuristic_table, (lower, upper, margin))
+  return bounds_cache[1]
+
+"""
+Returns (value, move) of state searched to depth. The value is exact when it's
+more than alpha, and otherwise at most alpha and no less than the exact value.
+order is the order of the directions for breaking ties at the root, as in
+expectimax
+"""
+def max_value(state, depth, alpha, bounds, order = None):
+  global nodes
+  nodes += 1
+  deepening.check()
+  if bitboard.game_over(state):
+    return (0, None)
+  if depth == 0:
+    return (bitboard.heuristic_value(state), None)
+
+  order = order or bitboard.directions
+  children = [(dir, res) for dir, (res, _) in
+              zip(bitboard.directions, bitboard.move_all(state))
+              if res != state]
+  # the best looking moves first, ties in the given order
+  children.sort(key = lambda child: (-bitboard.heuristic_value(child[1]),
+                                     order.index(child[0])))
+  margin = bounds[2]
+  best, best_move = -float("inf"), None
+  for dir, res in children:
+    # near ties are searched exactly so they're broken the way expectimax
+    # breaks them
+    v = chance_value(res, depth, max(alpha, best - margin), bounds)
+    if v > best or (v == best and order.index(dir) < order.index(best_move)):
+      best, best_move = v, dir
+  return (best, best_move)
+
+"""
+Returns the value of the chance node where a tile spawns on the moved board
+res, searched to depth. Exact when more than alpha, as with max_value
+"""
+def chance_value(res, depth, alpha, bounds):
+  global nodes
+  _, upper, margin = bounds
+  empties = bitboard.empty_tiles(res)
+  n = len(empties)
+  if depth == 1:
+    lines, values = bitboard.heuristic_lines(res)
+    deepening.check()
+
+  total = 0
+  # the probability of the children still to search
+  rest = 1.0
+  for empty_tile in empties:
+    # 0.9 - odds of a 2, which has a log value of 1
+    # 0.1 - odds of a 4, which has a log value of 2
+    for tile, odds in ((1, 0.9), (2, 0.1)):
+      p = odds / n
+      rest -= p
+      spawned = res | (tile << (empty_tile << 2))
+      if depth == 1:
+        # a leaf, scored as expectimax.leaf_evs does
+        nodes += 1
+        if n == 1 and bitboard.game_over(spawned):
+          v = 0
+        else:
+          v = bitboard.spawn_heuristic(lines, values, empty_tile, tile)
+        total += p * v
+      else:
+        # the value the child needs for this node to stay above alpha
+        child_alpha = (alpha - margin - total - max(rest, 0.0) * upper) / p
+        v = max_value(spawned, depth - 1, child_alpha, bounds)[0]
+        total += p * v
+        if v <= child_alpha:
+          # the child was cut off, so this node can't beat alpha either
+          return total + max(rest, 0.0) * upper
+      if rest > 0 and total + rest * upper <= alpha - margin:
+        return total + rest * upper
+  return total
+
+"""
+Returns the same (value, move) as expectimax.expectimax(state, depth, bitboard,
+order = order), searching fewer nodes. Nodes count towards expectimax.nodes as
+well, even when the search times out
+"""
+def search(state, depth, order = None):
+  before = nodes
+  try:
+    return max_value(state, depth, -float("inf"), bounds(), order)
+  finally:
+    expectimax.nodes += nodes - before
+
+"""
+Searches count positions from bench's corpus to depth with expectimax and with
+Star1, printing whether they chose the same move and how many nodes each
+searched. expectimax runs compiled when fastboard can, which counts nodes the
+same way. Returns whether every move matched
+"""
+def compare(count, depth, seed = 0):
+  # the benchmark suite is only needed for its corpus, not by games
+  import bench
+  boards = bench.corpus(count, seed)
+  positions = [b for stage in bench.stages for b in boards[stage]][:count]
+  matched = 0
+  plain_nodes = star_nodes = 0
+  plain_time = star_time = 0.0
+  for board in positions:
+    before = expectimax.nodes
+    start = time.perf_counter()
+    want = fastboard.search(board, depth)
+    plain_time += time.perf_counter() - start
+    plain = expectimax.nodes - before
+
+    before = nodes
+    start = time.perf_counter()
+    got = search(board, depth)
+    star_time += time.perf_counter() - start
+    searched = nodes - before
+
+    same = got == want
+    matched += same
+    plain_nodes += plain
+    star_nodes += searched
+    print(f"{board:#018x}: {want[1]} {plain} nodes, Star1 {got[1]} "
+          f"{searched} nodes ({1 - searched / plain:.1%} fewer)"
+          f"{'' if same else f', MISMATCH: {want} vs {got}'}")
+  print(f"{matched} of {len(positions)} searches matched. Star1 searched "
+        f"{star_nodes} nodes to expectimax's {plain_nodes}, "
+        f"{1 - star_nodes / plain_nodes:.1%} fewer")
+  print(f"Seconds: expectimax {round(plain_time, 2)}"
+        f"{' compiled' if fastboard.available else ''}, Star1 "
+        f"{round(star_time, 2)}")
+  return matched == len(positions)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Compare Star1 searches with plain expectimax")
+  parser.add_argument("--depth", type = int, default = 4)
+  parser.add_argument("--positions", type = int, default = 10,
+                      help = "corpus positions to search")
+  parser.add_argument("--seed", type = int, default = 0,
+                      help = "seed the corpus games are played from")
+  args = parser.parse_args()
+  with contextlib.redirect_stdout(io.StringIO()):
+    bitboard.init()
+  sys.exit(0 if compare(args.positions, args.depth, args.seed) else 1)
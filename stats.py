@@ -0,0 +1,127 @@
+import time, json
+
+"""
+Search instrumentation
+
+A SearchStats is passed to a search to have it count what it does. Engines
+only touch it when one is given, so searches without one pay for little more
+than a check for None at each node.
+
+Nodes are the calls the engine makes to search a state, counted by the depth
+left to search below them. They are split into max nodes (the player moves)
+and chance nodes (a tile spawns). Minimax searches its min nodes like any
+other, but expectimax averages over the spawns after each move without a call
+of their own, so its chance nodes are counted apart from the per-depth counts.
+Time is tracked separately for moving, spawning and evaluating the heuristic.
+"""
+
+timed_kinds = ("move", "spawn", "heuristic")
+
+class SearchStats:
+
+  def __init__(self):
+    # nodes[d] is the number of nodes with d levels left to search below them
+    self.nodes = {}
+    self.max_nodes = 0
+    self.chance_nodes = 0
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self.heuristic_hits = 0
+    self.heuristic_misses = 0
+    self.times = {kind: 0.0 for kind in timed_kinds}
+    # set by whoever runs the search
+    self.elapsed = 0.0
+    self.depth = 0
+
+  def enter(self, depth, chance = False):
+    self.nodes[depth] = self.nodes.get(depth, 0) + 1
+    if chance:
+      self.chance_nodes += 1
+    else:
+      self.max_nodes += 1
+
+  # counts a chance node that isn't searched by a call of its own
+  def chance(self):
+    self.chance_nodes += 1
+
+  def hit(self):
+    self.cache_hits += 1
+
+  def miss(self):
+    self.cache_misses += 1
+
+  # calls f(*args), adding the time it takes to the given kind
+  def time(self, kind, f, *args):
+    start = time.perf_counter()
+    res = f(*args)
+    self.times[kind] += time.perf_counter() - start
+    return res
+
+  # records the heuristic cache hits and misses between two cache_info()s
+  def heuristic_cache(self, before, after):
+    self.heuristic_hits += after.hits - before.hits
+    self.heuristic_misses += after.misses - before.misses
+
+  def total_nodes(self):
+    return sum(self.nodes.values())
+
+  """
+  Returns the mean number of children searched per node, measured as the ratio
+  of nodes at each depth to nodes one level up
+  """
+  def branching_factor(self):
+    ratios = [self.nodes[d - 1] / self.nodes[d] for d in self.nodes
+              if d - 1 in self.nodes and self.nodes[d]]
+    return sum(ratios) / len(ratios) if ratios else 0.0
+
+  """
+  Adds the counts of other into these stats, for totals over many searches
+  """
+  def merge(self, other):
+    for d, count in other.nodes.items():
+      self.nodes[d] = self.nodes.get(d, 0) + count
+    self.max_nodes += other.max_nodes
+    self.chance_nodes += other.chance_nodes
+    self.cache_hits += other.cache_hits
+    self.cache_misses += other.cache_misses
+    self.heuristic_hits += other.heuristic_hits
+    self.heuristic_misses += other.heuristic_misses
+    for kind in timed_kinds:
+      self.times[kind] += other.times[kind]
+    self.elapsed += other.elapsed
+    self.depth = max(self.depth, other.depth)
+
+  def to_dict(self):
+    return {
+      "nodes": self.total_nodes(),
+      "nodes_per_depth": {str(d): self.nodes[d] for d in sorted(self.nodes)},
+      "max_nodes": self.max_nodes,
+      "chance_nodes": self.chance_nodes,
+      "cache_hits": self.cache_hits,
+      "cache_misses": self.cache_misses,
+      "heuristic_cache_hits": self.heuristic_hits,
+      "heuristic_cache_misses": self.heuristic_misses,
+      "times": dict(self.times),
+      "elapsed": self.elapsed,
+      "depth": self.depth,
+      "branching_factor": self.branching_factor(),
+    }
+
+  @classmethod
+  def from_dict(cls, d):
+    res = cls()
+    res.nodes = {int(depth): count
+                 for depth, count in d["nodes_per_depth"].items()}
+    res.max_nodes = d["max_nodes"]
+    res.chance_nodes = d["chance_nodes"]
+    res.cache_hits = d["cache_hits"]
+    res.cache_misses = d["cache_misses"]
+    res.heuristic_hits = d["heuristic_cache_hits"]
+    res.heuristic_misses = d["heuristic_cache_misses"]
+    res.times = dict(d["times"])
+    res.elapsed = d["elapsed"]
+    res.depth = d["depth"]
+    return res
+
+  def to_json(self):
+    return json.dumps(self.to_dict())
@@ -1,6 +1,8 @@
 #!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
 import time, minimax, expectimax, board, random, bitboard, itertools, \
-       heuristics, timeit, functools, client, sys
+       heuristics, timeit, functools, client, sys, argparse, \
+       concurrent.futures, batch, numpy, stats, json, replay, \
+       engines, npboard
 from collections import Counter
 
 def test_all_boards(boards):
@@ -48,29 +50,161 @@ def test_heuristics_all_rows(nboards):
   og_bs = list(map(bit_to_list, bit_bs))
   bit_time = timeit.timeit(lambda: test_all_bitboards(bit_bs), number = 1)
   og_time = timeit.timeit(lambda: test_all_boards(og_bs), number = 1)
+  np_bs = numpy.stack([npboard.from_list(b) for b in og_bs])
+  np_time = timeit.timeit(lambda: npboard.heuristic_stack(np_bs), number = 1)
   print("Original time: ", str(og_time))
   print("Bit time: ", str(bit_time))
+  print("NumPy stack time: ", str(np_time))
 
-def time_runs(mode, run_count, imp, depth):
-  imp.init()
+"""
+Plays a single game seeded with seed and returns [moves, score, seconds,
+max tile, search nodes, Monte-Carlo playout moves, search stats]. With
+record_stats set the search stats are a list of stats.SearchStats dicts, one
+for each move searched, and otherwise None. With progress set, the game's
+score and speed are printed every progress moves as it plays
+"""
+def run_game(mode, imp, depth, seed, record_stats = False, progress = None,
+             **options):
+  random.seed(seed)
+  nodes = playout_moves = 0
+  stats_log = [] if record_stats else None
+  for event in client.play_game(mode, imp, depth, stats_log = stats_log,
+                                **options):
+    nodes += event.nodes
+    playout_moves += event.playout_moves
+    if progress and event.moves and event.moves % progress == 0:
+      print(f"  Game {seed}: {event.moves} moves, score {event.score}, "
+            f"max tile {imp.max_tile(event.board)}, "
+            f"{round(event.moves / event.elapsed, 2)} moves/sec")
+  return [event.moves, event.score, event.elapsed, imp.max_tile(event.board),
+          nodes, playout_moves,
+          None if stats_log is None else [x.to_dict() for x in stats_log]]
 
+# run_game in a worker process of time_runs's pool. Modules can't be sent to
+# another process, so the implementation is passed by name
+def run_game_job(mode, imp_name, depth, seed, record_stats, options):
+  return run_game(mode, engines.get(imp_name), depth, seed, record_stats,
+                  **options)
+
+# weights is None for the implementation's own
+def init_job_worker(imp_name, weights = None):
+  if weights is None:
+    engines.get(imp_name).init()
+  else:
+    engines.get(imp_name).init(weights)
+
+"""
+Writes the search stats of each game in res to stats_file as a JSON line per
+move, followed by a line with the totals over the run, and prints a summary
+"""
+def write_stats(res, stats_file):
+  total = stats.SearchStats()
+  with open(stats_file, "w") as f:
+    # res is in the order games finished, so sort it back into seed order
+    for game in sorted(res, key = lambda x: x[7]):
+      for move, record in enumerate(game[6]):
+        f.write(json.dumps({"seed": game[7], "move": move, **record}) + "\n")
+        total.merge(stats.SearchStats.from_dict(record))
+    f.write(json.dumps({"total": total.to_dict()}) + "\n")
+
+  lookups = total.cache_hits + total.cache_misses
+  heuristic_lookups = total.heuristic_hits + total.heuristic_misses
+  print("Search stats written to", stats_file)
+  print("  Nodes:", total.total_nodes(), "max:", total.max_nodes,
+        "chance:", total.chance_nodes)
+  print("  Nodes per depth:",
+        ", ".join(f"{d}: {total.nodes[d]}"
+                  for d in sorted(total.nodes, reverse = True)))
+  print("  Effective branching factor:", round(total.branching_factor(), 2))
+  if lookups:
+    print("  Cache hit rate:", round(total.cache_hits / lookups, 4))
+  if heuristic_lookups:
+    print("  Heuristic cache hit rate:",
+          round(total.heuristic_hits / heuristic_lookups, 4))
+  print("  Seconds searching:", round(total.elapsed, 2), "moving:",
+        round(total.times["move"], 2), "spawning:",
+        round(total.times["spawn"], 2), "heuristic:",
+        round(total.times["heuristic"], 2))
+
+"""
+Plays run_count games, game n seeded with seed + n so that results don't
+depend on how the games are scheduled. With jobs set, games are played in
+that many processes at once and reported as they finish. Each game's seed is
+appended to its run_game result. With stats_file set, searches are recorded
+and written there by write_stats. With record_file set, the games are
+appended to it as a replay log (not with jobs, whose games play apart).
+weights, if given, are the heuristic weights or a weights file to play with.
+star_pruning plays bitboard expectimax games with Star1 searches. progress
+is passed on to run_game.
+"""
+def time_runs(mode, run_count, imp, depth, cutoff = 0.0, max_spawns = None,
+              ms_per_move = None, workers = None, jobs = None, seed = 0,
+              playouts = 100, horizon = 20, guided = False, symmetric = False,
+              stats_file = None, record_file = None, weights = None,
+              star_pruning = False, progress = None):
+  imp_name = engines.name_of(imp)
+  init_job_worker(imp_name, weights)
+  options = {"cutoff": cutoff, "max_spawns": max_spawns,
+             "ms_per_move": ms_per_move, "workers": workers,
+             "playouts": playouts, "horizon": horizon, "guided": guided,
+             "symmetric": symmetric, "star_pruning": star_pruning,
+             "progress": progress}
+
+  record_stats = stats_file is not None
   res = []
-  start = time.time()
+  wall_start = time.time()
   print("Beginning timing...")
-  for n in range(run_count):
-    print(f"Beginning iteration {n+1}...")
-    main, moves, t, m = client.run_iteration(mode, imp, depth, prints = False)
-    end = time.time() - start
-    res.append([moves, t, end, imp.max_tile(main)])
-    print(f"Iteration {n+1} completed in {round(end, 2)} seconds...")
-    start = time.time()
+  if jobs is None:
+    recorder = None if record_file is None else replay.Recorder(record_file)
+    try:
+      for n in range(run_count):
+        print(f"Beginning iteration {n+1}...")
+        res.append(run_game(mode, imp, depth, seed + n, record_stats,
+                            recorder = recorder, **options) + [seed + n])
+        print(f"Iteration {n+1} completed in {round(res[-1][2], 2)} "
+              "seconds...")
+    finally:
+      if recorder is not None:
+        recorder.close()
+  else:
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = jobs, initializer = init_job_worker,
+        initargs = (imp_name, weights)) as pool:
+      futures = {pool.submit(run_game_job, mode, imp_name, depth, seed + n,
+                             record_stats, options): n
+                 for n in range(run_count)}
+      for future in concurrent.futures.as_completed(futures):
+        res.append(future.result() + [seed + futures[future]])
+        moves, t, end, m = res[-1][:4]
+        print(f"Iteration {futures[future]+1} completed in {round(end, 2)} "
+              f"seconds: {moves} moves, score {t}, max tile {m}")
+  wall_time = time.time() - wall_start
 
   maxes = [x[3] for x in res]
   total_time = sum([x[2] for x in res])
   total_score = sum([x[1] for x in res])
   total_moves = sum([x[0] for x in res])
+  total_nodes = sum([x[4] for x in res])
+  total_playout_moves = sum([x[5] for x in res])
 
-  print("Ran", str(run_count), mode, "games in", round(total_time, 2), "seconds.")
+  print("Ran", str(run_count), mode, "games in", round(wall_time, 2), "seconds.")
+  if jobs is not None:
+    print("Games played over", jobs, "processes, taking",
+          round(total_time, 2), "seconds in total.")
+  if ms_per_move is not None:
+    print("Time budget:", ms_per_move, "ms per move")
+  if mode == "expectimax":
+    print("Search depth:", depth, "probability cutoff:", cutoff,
+          "max spawns:", max_spawns, "workers:", workers,
+          "symmetric:", symmetric, "Star1:", star_pruning)
+  if mode != "montecarlo" and mode != "random":
+    print("Average nodes/sec: ", round(total_nodes/total_time, 2))
+  if mode == "montecarlo":
+    print("Playouts per move:", playouts, "horizon:", horizon,
+          "guided:", guided)
+    print("Average playout moves/sec: ",
+          round(total_playout_moves/total_time, 2))
+  # rates are per process, so they stay comparable however many jobs run
   print("Average moves/sec: ", round(total_moves/total_time, 2))
   print("Average final score: ", round(total_score/run_count, 2))
   print("Max final tile distribution:")
@@ -80,31 +214,145 @@ def time_runs(mode, run_count, imp, depth):
   for v in sorted(occs.keys(), reverse = True):
     print("  * ", str(v), ": ", occs[v])
 
+  if record_stats:
+    write_stats(res, stats_file)
+
   return res
 
+"""
+Plays run_count random games at once with the batched bitboards
+"""
+def time_batch_runs(run_count, seed = 0):
+  batch.init()
+
+  print("Beginning timing...")
+  start = time.time()
+  boards, moves, scores = batch.random_games(run_count,
+                                             numpy.random.default_rng(seed))
+  total_time = time.time() - start
+
+  print("Ran", str(run_count), "random games in", round(total_time, 2),
+        "seconds.")
+  print("Average moves/sec: ", round(int(moves.sum())/total_time, 2))
+  print("Average final score: ", round(float(scores.mean()), 2))
+  print("Max final tile distribution:")
+
+  occs = Counter(batch.max_tile_batch(boards).tolist())
+
+  for v in sorted(occs.keys(), reverse = True):
+    print("  * ", str(v), ": ", occs[v])
+
+  return boards, moves, scores
+
+"""
+Prints the results of time_runs for each implementation, {name: res}, side by
+side. The games are played from the same seeds, so only the speeds differ for
+implementations that play the same way
+"""
+def compare_runs(results):
+  print(f"{'implementation':<16} {'seconds':>10} {'moves/sec':>12} "
+        f"{'nodes/sec':>12} {'score':>10}")
+  for name, res in results.items():
+    total_time = sum(x[2] for x in res)
+    print(f"{name:<16} {total_time:>10.2f} "
+          f"{sum(x[0] for x in res) / total_time:>12.2f} "
+          f"{sum(x[4] for x in res) / total_time:>12.2f} "
+          f"{sum(x[1] for x in res) / len(res):>10.2f}")
+
 valid_modes = ["minimax_random", "minimax_antagonistic", "expectimax",
-               "random"]
-valid_imps  = ["board", "bitboard"]
-imp_map = {
-  "board": board,
-  "bitboard": bitboard
-}
+               "montecarlo", "random"]
+valid_imps  = list(engines.registry) + ["batch"]
 if __name__ == "__main__":
-  if len(sys.argv) != 5:
-    print("Usage: timing.py [mode] [run_count] [implementation] [depth]")
-  else:
-    mode = sys.argv[1]
-    imp = sys.argv[3]
-    if mode not in valid_modes:
-      print("Invalid mode: " + mode)
-      print("Valid modes:")
-      for m in valid_modes:
-          print("  * " + m)
-      sys.exit()
-    if imp not in valid_imps:
-      print("Invalid implementation: " + imp)
-      print("Valid implementations:")
-      for i in valid_imps:
-        print("  * " + i)
-      sys.exit()
-    time_runs(mode, int(sys.argv[2]), imp_map[imp], int(sys.argv[4]))
+  parser = argparse.ArgumentParser(
+    description = "Time games played with the given strategy")
+  parser.add_argument("mode", choices = valid_modes)
+  parser.add_argument("run_count", type = int)
+  parser.add_argument("implementation", choices = valid_imps, nargs = "+",
+                      help = "implementations to time, one after another, "
+                             "compared side by side if there are several")
+  parser.add_argument("depth", type = int)
+  parser.add_argument("--cutoff", type = float, default = 0.0,
+                      help = "expectimax: stop searching paths less likely "
+                             "than this")
+  parser.add_argument("--max-spawns", type = int, default = None,
+                      help = "expectimax: sample at most this many spawn "
+                             "positions per chance node")
+  parser.add_argument("--ms-per-move", type = float, default = None,
+                      help = "deepen searches until this many milliseconds "
+                             "have passed, up to the given depth")
+  parser.add_argument("--workers", type = int, default = None,
+                      help = "expectimax: search in parallel over this many "
+                             "processes (bitboard only)")
+  parser.add_argument("--jobs", type = int, default = None,
+                      help = "play this many games at once in separate "
+                             "processes")
+  parser.add_argument("--seed", type = int, default = 0,
+                      help = "game n is seeded with this plus n")
+  parser.add_argument("--playouts", type = int, default = 100,
+                      help = "montecarlo: playouts per legal move")
+  parser.add_argument("--horizon", type = int, default = 20,
+                      help = "montecarlo: moves per playout, or 0 to play "
+                             "until the game ends")
+  parser.add_argument("--guided", action = "store_true",
+                      help = "montecarlo: make the move that merges the most "
+                             "in playouts instead of a random one")
+  parser.add_argument("--symmetric", action = "store_true",
+                      help = "expectimax: share transposition table entries "
+                             "between rotations and reflections of a board")
+  parser.add_argument("--stats", metavar = "FILE", default = None,
+                      help = "record minimax and expectimax searches and "
+                             "write them to FILE as JSON lines")
+  parser.add_argument("--record", metavar = "FILE", default = None,
+                      help = "append the games to FILE as a replay log")
+  parser.add_argument("--weights", metavar = "FILE", default = None,
+                      help = "bitboard: play with the heuristic weights in "
+                             "FILE, as written by tune.py")
+  parser.add_argument("--star", action = "store_true",
+                      help = "expectimax: search with Star1 pruning, which "
+                             "chooses the same moves as a search without a "
+                             "table (bitboard only)")
+  parser.add_argument("--progress", type = int, metavar = "N", default = None,
+                      help = "print each game's score and speed every N "
+                             "moves while it plays")
+  args = parser.parse_args()
+  if args.jobs is not None and args.workers is not None:
+    parser.error("--jobs and --workers can't be used together")
+  if args.jobs is not None and args.record is not None:
+    parser.error("--jobs and --record can't be used together")
+  if args.weights is not None and args.implementation != ["bitboard"]:
+    parser.error("--weights is only used by the bitboard implementation")
+  if args.stats is not None and len(args.implementation) > 1:
+    parser.error("--stats records a single implementation")
+  if args.star:
+    if args.mode != "expectimax" or args.implementation != ["bitboard"]:
+      parser.error("--star only searches bitboard expectimax games")
+    if args.cutoff or args.max_spawns is not None or \
+       args.workers is not None or args.symmetric or args.stats is not None:
+      parser.error("--star can't be used with --cutoff, --max-spawns, "
+                   "--workers, --symmetric or --stats")
+  if "batch" in args.implementation:
+    if args.implementation != ["batch"]:
+      parser.error("the batch implementation can't be compared with others")
+    if args.mode != "random":
+      parser.error("the batch implementation only plays random games")
+    time_batch_runs(args.run_count, seed = args.seed)
+    sys.exit()
+  for name in args.implementation:
+    if not engines.supports(engines.get(name), args.mode):
+      parser.error(f"the {name} implementation doesn't play {args.mode} games")
+
+  results = {}
+  for name in args.implementation:
+    if len(args.implementation) > 1:
+      print(f"Timing {name}...")
+    results[name] = time_runs(
+      args.mode, args.run_count, engines.get(name), args.depth,
+      cutoff = args.cutoff, max_spawns = args.max_spawns,
+      ms_per_move = args.ms_per_move, workers = args.workers,
+      jobs = args.jobs, seed = args.seed, playouts = args.playouts,
+      horizon = args.horizon or None, guided = args.guided,
+      symmetric = args.symmetric, stats_file = args.stats,
+      record_file = args.record, weights = args.weights,
+      star_pruning = args.star, progress = args.progress)
+  if len(results) > 1:
+    compare_runs(results)
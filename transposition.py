@@ -0,0 +1,146 @@
+import bitboard
+from array import array
+
+"""
+Custom exceptions
+"""
+class InvalidReplacementPolicy(Exception):
+  pass
+
+"""
+Transposition table for searches over bitboards
+
+Entries are (board, depth, value, best move) and live in flat arrays indexed by
+a hash of the board. Collisions are resolved by probing the next few slots
+(open addressing), and when every probed slot is taken the replacement policy
+decides which entry to give up:
+
+  depth:  replace the shallowest probed entry, but only with one at least as
+          deep, so expensive results survive cheap ones
+  always: replace the entry in the board's home slot
+
+A lookup is satisfied by any entry for the same board searched to at least the
+requested depth, since a deeper result is a better estimate of the same value.
+
+Boards are looked up by the key returned from key(). In a symmetric table that
+is the canonical form of the board, so all 8 rotations and reflections share
+one entry, and best moves are stored for the canonical form and mapped back
+through the symmetry on the way out.
+"""
+
+# best moves are stored as an index into this tuple, with -1 for no move
+moves = ("L", "R", "U", "D")
+move_index = {m: i for i, m in enumerate(moves)}
+
+policies = ("depth", "always")
+
+class TranspositionTable:
+
+  # size_log2 is the log of the number of slots, probes the number of slots
+  # tried on each lookup or store before giving up
+  def __init__(self, size_log2 = 20, policy = "depth", probes = 4,
+               symmetric = False):
+    if policy not in policies:
+      raise InvalidReplacementPolicy(policy)
+    self.symmetric = symmetric
+    self.size = 1 << size_log2
+    self.shift = 64 - size_log2
+    self.mask = self.size - 1
+    self.policy = policy
+    self.probes = probes
+    self.keys = array("Q", bytes(8 * self.size))
+    # -1 marks an empty slot
+    self.depths = array("b", [-1]) * self.size
+    self.values = array("d", bytes(8 * self.size))
+    self.moves = array("b", [-1]) * self.size
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.hits = self.misses = self.collisions = 0
+    self.stores = self.replacements = 0
+
+  def clear(self):
+    self.depths = array("b", [-1]) * self.size
+    self.reset_stats()
+
+  # fibonacci hashing - the top bits of the product are well mixed even though
+  # neighbouring boards differ in just a few nibbles
+  def home(self, board):
+    return ((board * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+
+  """
+  Returns the (key, symmetry) pair to look board up and store it with
+  """
+  def key(self, board):
+    if self.symmetric:
+      return bitboard.canonical(board)
+    return board, 0
+
+  """
+  Returns (value, move) for the board with the given key and symmetry if it
+  has been searched to at least depth, and None otherwise
+  """
+  def lookup(self, board, depth, symmetry = 0):
+    keys, depths, mask = self.keys, self.depths, self.mask
+    slot = self.home(board)
+    for _ in range(self.probes):
+      stored = depths[slot]
+      if stored < 0:
+        break
+      if keys[slot] == board:
+        if stored >= depth:
+          self.hits += 1
+          m = self.moves[slot]
+          if m < 0:
+            return self.values[slot], None
+          return self.values[slot], bitboard.unsymmetry_dirs[symmetry][moves[m]]
+        break
+      self.collisions += 1
+      slot = (slot + 1) & mask
+    self.misses += 1
+    return None
+
+  """
+  Records that the board with the given key and symmetry, searched to depth,
+  has the given value and best move
+  """
+  def store(self, board, depth, value, move, symmetry = 0):
+    keys, depths, mask = self.keys, self.depths, self.mask
+    slot = home = self.home(board)
+    victim = None
+    for _ in range(self.probes):
+      stored = depths[slot]
+      if stored < 0 or keys[slot] == board:
+        # an existing entry for the same board is only ever made deeper
+        if stored > depth and self.policy == "depth":
+          return
+        victim = slot
+        break
+      if victim is None or stored < depths[victim]:
+        victim = slot
+      slot = (slot + 1) & mask
+    else:
+      # every probed slot holds another board
+      if self.policy == "always":
+        victim = home
+      elif depths[victim] > depth:
+        return
+      self.replacements += 1
+
+    keys[victim] = board
+    depths[victim] = depth
+    self.values[victim] = value
+    self.moves[victim] = -1 if move is None else \
+                         move_index[bitboard.symmetry_dirs[symmetry][move]]
+    self.stores += 1
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "collisions": self.collisions,
+      "stores": self.stores,
+      "replacements": self.replacements,
+      "hit_rate": self.hits / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,179 @@
+#!/Library/Frameworks/Python.framework/Versions/3.9/bin/python3
+import random, math, json, os, time, argparse, concurrent.futures, \
+       contextlib, io, bitboard, client
+
+"""
+Heuristic weight tuning
+
+A simple evolution strategy over the bitboard heuristic weights. Each
+generation samples candidates around the current mean, scores every candidate
+by the mean score of the same seeded games, and moves the mean to the average
+of the best. Weights are searched in log space, so a step scales each weight
+by a factor rather than adding to it, which keeps them positive and lets
+weights of very different sizes move in proportion. The step size shrinks by
+a fixed factor every generation.
+
+Candidates are evaluated in parallel, one per worker process at a time. A
+worker loads the move tables once and only rebuilds the heuristic table for
+each candidate, without touching the table cache on disk.
+
+The state of the search is checkpointed after every generation and a run picks
+up from its checkpoint when restarted, losing at most the generation that was
+in progress. The best weights so far are also written to a weights file that
+bitboard.init, and timing.py's --weights option, can load.
+"""
+
+def init_worker():
+  bitboard.init_moves()
+
+"""
+Plays a game with the given weights for each seed and returns the mean score.
+Runs in a worker process
+"""
+def evaluate(weights, seeds, mode, depth):
+  # the table build reports itself, which is just noise from a worker
+  with contextlib.redirect_stdout(io.StringIO()):
+    bitboard.init_heuristics(weights, cache = False)
+  total = 0
+  for seed in seeds:
+    random.seed(seed)
+    total += client.run_iteration(mode, bitboard, depth, prints = False)[2]
+  return total / len(seeds)
+
+"""
+Returns lam candidates sampled from rng around mean (the log weights) with
+step size sigma
+"""
+def sample(mean, sigma, lam, rng):
+  return [[m + sigma * rng.gauss(0, 1) for m in mean] for _ in range(lam)]
+
+def to_weights(logs):
+  return tuple(math.exp(x) for x in logs)
+
+def new_state(weights, sigma, seed):
+  return {
+    "generation": 0,
+    "mean": [math.log(w) for w in weights],
+    "sigma": sigma,
+    "seed": seed,
+    "best": None,
+    "history": [],
+  }
+
+def load_checkpoint(path):
+  with open(path) as f:
+    return json.load(f)
+
+def save_checkpoint(path, state):
+  tmp = f"{path}.{os.getpid()}.tmp"
+  with open(tmp, "w") as f:
+    json.dump(state, f, indent = 1)
+  os.replace(tmp, path)
+
+"""
+Runs generations of the evolution strategy from state, checkpointing after
+each one, and returns the final state
+"""
+def tune(state, generations, lam, mu, games, mode, depth, decay, workers,
+         checkpoint, out):
+  with concurrent.futures.ProcessPoolExecutor(
+      max_workers = workers, initializer = init_worker) as pool:
+    while state["generation"] < generations:
+      gen = state["generation"]
+      # every candidate of a generation plays the same games, and every
+      # generation is sampled from its own seed, so a resumed run carries on
+      # exactly as an uninterrupted one would
+      rng = random.Random(state["seed"] * 1000003 + gen)
+      seeds = [state["seed"] * 1000003 + gen * games + n
+               for n in range(games)]
+      candidates = sample(state["mean"], state["sigma"], lam, rng)
+      # the current mean is evaluated too, to track progress on the same games
+      candidates.append(state["mean"])
+
+      start = time.time()
+      fitness = list(pool.map(evaluate, map(to_weights, candidates),
+                              [seeds] * len(candidates),
+                              [mode] * len(candidates),
+                              [depth] * len(candidates)))
+      mean_fitness = fitness.pop()
+      candidates.pop()
+
+      ranked = sorted(range(lam), key = lambda i: fitness[i], reverse = True)
+      elite = [candidates[i] for i in ranked[:mu]]
+      top = ranked[0]
+      if state["best"] is None or fitness[top] > state["best"]["fitness"]:
+        state["best"] = {"weights": list(to_weights(candidates[top])),
+                         "fitness": fitness[top], "generation": gen}
+
+      state["mean"] = [sum(x) / mu for x in zip(*elite)]
+      state["sigma"] *= decay
+      state["generation"] = gen + 1
+      state["history"].append({"generation": gen,
+                               "mean_fitness": mean_fitness,
+                               "best_fitness": fitness[top],
+                               "seconds": time.time() - start})
+      save_checkpoint(checkpoint, state)
+      bitboard.save_weights(out, state["best"]["weights"],
+                            fitness = state["best"]["fitness"],
+                            generation = state["best"]["generation"],
+                            mode = mode, depth = depth, games = games)
+
+      print(f"Generation {gen+1}: mean {round(mean_fitness, 2)}, best "
+            f"{round(fitness[top], 2)}, overall best "
+            f"{round(state['best']['fitness'], 2)} in "
+            f"{round(time.time() - start, 2)} seconds")
+  return state
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+    description = "Tune the bitboard heuristic weights by playing games")
+  parser.add_argument("--generations", type = int, default = 50,
+                      help = "generations to run in total, resumed ones "
+                             "included")
+  parser.add_argument("--population", type = int, default = 12,
+                      help = "candidates per generation")
+  parser.add_argument("--parents", type = int, default = 3,
+                      help = "best candidates the next mean is taken from")
+  parser.add_argument("--games", type = int, default = 8,
+                      help = "seeded games each candidate plays")
+  parser.add_argument("--mode", default = "expectimax",
+                      choices = ["expectimax", "minimax_random"])
+  parser.add_argument("--depth", type = int, default = 1)
+  parser.add_argument("--sigma", type = float, default = 0.3,
+                      help = "initial step size, as a log of the factor "
+                             "weights are scaled by")
+  parser.add_argument("--decay", type = float, default = 0.95,
+                      help = "factor the step size shrinks by per generation")
+  parser.add_argument("--seed", type = int, default = 0)
+  parser.add_argument("--workers", type = int, default = os.cpu_count(),
+                      help = "processes to evaluate candidates in")
+  parser.add_argument("--start", metavar = "FILE", default = None,
+                      help = "weights file to start from (default: the "
+                             "built-in weights)")
+  parser.add_argument("--checkpoint", default = "tune-checkpoint.json",
+                      help = "file the search state is saved to and resumed "
+                             "from")
+  parser.add_argument("--out", default = "weights.json",
+                      help = "weights file the best weights are written to")
+  args = parser.parse_args()
+  if not 0 < args.parents <= args.population:
+    parser.error("--parents must be between 1 and --population")
+
+  if os.path.exists(args.checkpoint):
+    state = load_checkpoint(args.checkpoint)
+    print(f"Resuming from generation {state['generation']+1} of "
+          f"{args.checkpoint}")
+  else:
+    weights = bitboard.heuristic_weights if args.start is None else \
+              bitboard.load_weights(args.start)
+    if min(weights) <= 0:
+      parser.error("weights are tuned in log space, so they must be positive")
+    state = new_state(weights, args.sigma, args.seed)
+
+  state = tune(state, args.generations, args.population, args.parents,
+               args.games, args.mode, args.depth, args.decay, args.workers,
+               args.checkpoint, args.out)
+  if state["best"] is not None:
+    print("Best weights:", tuple(state["best"]["weights"]), "scoring",
+          round(state["best"]["fitness"], 2))
+    print("Written to", args.out)